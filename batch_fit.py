@@ -0,0 +1,204 @@
+# batch_fit.py
+"""
+Headless batch fitting of many .inp / .csv input files.
+
+Each file goes through readinp/readcsv_custom -> fitorb -> orbsave in its
+own worker process, and one summary table with the fitted elements,
+errors, chi2 and masses of every system is written at the end.
+
+    python batch_fit.py input_data/ --outdir results/ --workers 4 --timeout 120
+    python batch_fit.py manifest.txt --fix K1,K2,V0 --summary summary.csv
+    python batch_fit.py input_data/ --outdir results/ --format npz --force
+
+An existing output file is not overwritten unless --force is given; that
+input is reported as an error instead.
+"""
+
+import argparse
+import io
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from rv_orbital_fitting_with_advanced_gui import (
+    OrbitFit, ELNAME, RESULT_FORMATS, EPH_BACKENDS, calculate_total_mass, calculate_spectroscopic_masses, ephbackend)
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def _alarm(signum, frame):
+    raise FitTimeout("fit exceeded the time limit")
+
+
+# Collect input files from directories, manifests and plain file arguments
+def collect_inputs(sources):
+    files = []
+    for src in sources:
+        if os.path.isdir(src):
+            for fname in sorted(os.listdir(src)):
+                if fname.endswith('_output.csv'):
+                    continue
+                if fname.endswith('.inp') or fname.endswith('.csv'):
+                    files.append(os.path.join(src, fname))
+        elif src.endswith('.inp') or src.endswith('.csv'):
+            files.append(src)
+        else:
+            # Manifest: one path per line, relative to the manifest itself
+            base = os.path.dirname(src)
+            with open(src, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    files.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return files
+
+
+# Fit one file; runs in a worker process and never raises
+def fit_one(path, fix=None, outdir=None, timeout=None, rvseed=False, warm=False, fmt='csv', plots=False,
+            force=False):
+    row = {'File': path, 'Status': 'ok', 'Message': ''}
+    t0 = time.time()
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        fit = OrbitFit(out=io.StringIO())
+        fit.obscache = None  # no parsed-data cache in the caller's working directory
+        if path.endswith('.csv'):
+            fit.readcsv_custom(path)
+        else:
+            fit.readinp(path)
+        if fit.obj['fname'] == '':
+            raise FileNotFoundError(f"File {path} not found")
+        # Output next to the input, or under outdir; built from the path
+        # itself, so dots in directory names (./data) do not cut it short
+        stem = os.path.splitext(path)[0]
+        if outdir is not None:
+            stem = os.path.join(outdir, os.path.basename(stem))
+        outfile = f"{stem}_output.{fmt}"
+        if os.path.exists(outfile) and not force:
+            raise FileExistsError(f"{outfile} exists, use --force to overwrite it")
+        # Warm start from the output of a previous run
+        if warm and os.path.exists(outfile):
+            fit.loadel(outfile)
+        if fix is not None:
+            fit.fixel = np.ones(10, dtype=int)
+            for i, name in enumerate(fit.elname):
+                if name in fix:
+                    fit.fixel[i] = 0
+        elif fit.obj['nrv1'] == 0 and fit.obj['nrv2'] == 0:
+            fit.fixel[7:10] = 0  # K1, K2 and V0 are not constrained without RVs
+        if rvseed and (fit.obj['nrv1'] > 0 or fit.obj['nrv2'] > 0):
+            fit.rvseed()
+        fit.fitorb()
+        if plots:
+            for key, png in fit.plotbytes().items():
+                with open(f"{stem}_{key}.png", 'wb') as f:
+                    f.write(png)
+        fit.orbsave(outfile, fmt)
+
+        total_mass = calculate_total_mass(fit.el[0], fit.el[3], fit.obj['parallax'])
+        M12_sin3i, M1, M2 = calculate_spectroscopic_masses(fit.el[0], fit.el[2], fit.el[6], fit.el[7], fit.el[8])
+        row.update({'Object': fit.obj['name'], 'Npos': fit.obj['npos'],
+                    'Nrv1': fit.obj['nrv1'], 'Nrv2': fit.obj['nrv2']})
+        for k, name in enumerate(ELNAME):
+            row[name] = fit.el[k]
+            row[f"{name}_Err"] = fit.elerr[k]
+            row[f"{name}_Fixed"] = int(fit.fixel[k] == 0)
+        row.update({'CHI2': fit.obj['chi2'],
+                    'CHI2/N_Theta': fit.obj['chi2n'][0], 'CHI2/N_Rho': fit.obj['chi2n'][1],
+                    'CHI2/N_RV1': fit.obj['chi2n'][2], 'CHI2/N_RV2': fit.obj['chi2n'][3],
+                    'RMS_Theta': fit.obj['rms'][0], 'RMS_Rho': fit.obj['rms'][1],
+                    'RMS_RV1': fit.obj['rms'][2], 'RMS_RV2': fit.obj['rms'][3],
+                    'Parallax_mas': fit.obj['parallax'], 'Total_Mass_Msun': total_mass,
+                    'M(1+2)_sin3i': M12_sin3i, 'M1_Msun': M1, 'M2_Msun': M2})
+    except FitTimeout as e:
+        row.update({'Status': 'timeout', 'Message': str(e)})
+    except Exception as e:
+        row.update({'Status': 'error', 'Message': f"{type(e).__name__}: {e}"})
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    row['Time_s'] = time.time() - t0
+    return row
+
+
+# Fan the files out over a process pool and gather one summary row each
+def run_batch(files, fix=None, outdir=None, workers=None, timeout=None, rvseed=False, warm=False,
+              fmt='csv', plots=False, force=False, log=sys.stdout):
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    rows = [None] * len(files)
+    ndone = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fit_one, path, fix, outdir, timeout, rvseed, warm, fmt, plots, force): k for k, path in enumerate(files)}
+        for fut in as_completed(futures):
+            k = futures[fut]
+            path = files[k]
+            try:
+                row = fut.result()
+            except Exception as e:
+                # The worker process itself died (crash, out of memory)
+                row = {'File': path, 'Status': 'error', 'Message': f"{type(e).__name__}: {e}"}
+            rows[k] = row
+            ndone += 1
+            print(f"[{ndone}/{len(files)}] {row['Status']:<7} {path} {row['Message']}", file=log)
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch orbital fitting of .inp/.csv files")
+    parser.add_argument('sources', nargs='+', help="input directories, files, or manifest files listing paths")
+    parser.add_argument('--fix', default=None,
+                        help="comma-separated elements to fix, e.g. K1,K2,V0 (default: K1, K2 and V0 for "
+                             "inputs without RVs, none otherwise)")
+    parser.add_argument('--outdir', default=None, help="directory for *_output files (default: next to each input)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument('--timeout', type=float, default=300, help="per-file time limit in seconds (0 disables)")
+    parser.add_argument('--rvseed', action='store_true',
+                        help="seed P, T, e, w, K1, K2, V0 from an RV periodogram before fitting")
+    parser.add_argument('--warm', action='store_true',
+                        help="start from the elements of an existing output of the same input (with --force)")
+    parser.add_argument('--force', action='store_true', help="overwrite existing *_output files")
+    parser.add_argument('--format', choices=RESULT_FORMATS, default='csv',
+                        help="per-file result format: sectioned CSV or NumPy archive (read with loadresults)")
+    parser.add_argument('--plots', action='store_true',
+                        help="also render the orbit, RV and residual plots as PNG next to each output")
+    parser.add_argument('--backend', choices=['auto'] + list(EPH_BACKENDS), default=None,
+                        help="ephemeris backend (default: $ORBIT_EPH_BACKEND, else numpy)")
+    parser.add_argument('--summary', default='batch_summary.csv', help="consolidated summary table")
+    args = parser.parse_args(argv)
+    if args.backend is not None:
+        # Exported to the environment, so the worker processes follow
+        print(f"Ephemeris backend: {ephbackend(args.backend)}")
+
+    fix = None
+    if args.fix is not None:
+        fix = [name.strip() for name in args.fix.split(',') if name.strip()]
+        unknown = [name for name in fix if name not in ELNAME]
+        if unknown:
+            parser.error(f"unknown elements in --fix: {unknown}")
+
+    files = collect_inputs(args.sources)
+    if not files:
+        parser.error("no .inp or .csv files found")
+    summary = run_batch(files, fix=fix, outdir=args.outdir, workers=args.workers,
+                        timeout=args.timeout or None, rvseed=args.rvseed, warm=args.warm,
+                        fmt=args.format, plots=args.plots, force=args.force)
+    summary.to_csv(args.summary, index=False)
+    nok = int((summary['Status'] == 'ok').sum())
+    print(f"{nok}/{len(files)} fits succeeded, summary saved to {args.summary}")
+    return 0 if nok == len(files) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
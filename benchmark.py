@@ -0,0 +1,393 @@
+# benchmark.py
+"""
+Reproducible benchmarks and answer checks for the orbit fitting code.
+
+    python benchmark.py run --sizes 20,1000,100000,1000000 --out bench.csv
+    python benchmark.py check temp_data/
+    python benchmark.py check temp_data/ --allow ''
+    python benchmark.py generate synth.inp --npos 40 --nrv 60 --e 0.6 --seed 3
+    python benchmark.py parity
+
+`run` times eph (RV and astrometric, e = 0.2, 0.95 and 0.99), fitorb (VB-only,
+SB2-only, combined), both parsers (plain, from the binary cache and, for
+.inp, against a per-line float() loop) and orbsave (csv, npz) on
+synthetic orbits with known true elements, and the derived-mass
+distributions of element ensembles, at every size in --sizes. `check`
+refits the inputs of the shipped *_output.csv files with their fix flags
+and compares the observation counts and the elements, so a speedup can be
+shown not to change the answers; the references in KNOWN_CHANGES, whose
+answers were changed on purpose, are reported as 'allowed' (--allow ''
+makes them fail). `generate` writes a synthetic .inp or
+.csv input file. `parity` compares every available eph() backend with the
+NumPy reference. All synthetic data come from a fixed seed.
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from rv_orbital_fitting_with_advanced_gui import (OrbitFit, RunStats, canonel, eph, ephbackend, ephbackends,
+                                                  eph_numpy, massdist, readresult,
+                                                  ELNAME, EPH_LOADED)
+
+# True elements of the synthetic system; e is replaced per case
+TRUE_EL = np.array([11.77, 1993.51, 0.22, 0.225, 106.3, 89.4, 82.6, 7.54, 6.96, -3.91])
+# Scale of the offsets of the fit start from the truth
+START_STEP = np.array([0.01, 0.1, 0.02, 0.005, 2.0, 2.0, 2.0, 0.1, 0.1, 0.1])
+
+
+# Epoch in years to the truncated JD used for RVs in the input files
+def year2jd(t):
+    return 365.242198781 * (t - 1900) + 15020.31352
+
+
+# Synthetic observations of the orbit el: npos positions (t, theta, rho,
+# err) and nrv1 / nrv2 RVs (t, V, err), over `span` years from T, with
+# Gaussian errors of rho_err (arcsec) and rv_err (km/s). Epochs are in
+# years for positions and truncated JD for RVs, as in the sample inputs.
+# Position angles are not folded back into [0, 360) after adding noise,
+# so no residual jumps by 360 degrees.
+def synthorbit(el, npos=20, nrv1=0, nrv2=0, span=None, rho_err=0.002, rv_err=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    span = 2 * el[0] if span is None else span
+    data = {'pos': np.zeros((0, 4)), 'rv1': np.zeros((0, 3)), 'rv2': np.zeros((0, 3))}
+    if npos > 0:
+        t = np.sort(el[1] + span * rng.random(npos))
+        model = eph(el, t, rho=True)
+        rho = model[:, 1] + rho_err * rng.standard_normal(npos)
+        theta = model[:, 0] + np.degrees(rho_err / model[:, 1]) * rng.standard_normal(npos)
+        data['pos'] = np.column_stack([t, theta, rho, np.full(npos, rho_err)])
+    for key, col, nrv in (('rv1', 0, nrv1), ('rv2', 1, nrv2)):
+        if nrv > 0:
+            t = np.sort(el[1] + span * rng.random(nrv))
+            v = eph(el, t, rv=True)[:, col] + rv_err * rng.standard_normal(nrv)
+            data[key] = np.column_stack([year2jd(t), v, np.full(nrv, rv_err)])
+    return data
+
+
+# Write a synthetic data set in the .inp format
+def writeinp(fname, el, data, name='Synthetic', parallax=20.0):
+    with open(fname, 'w') as f:
+        f.write(f"Object: {name}\nRA: 12.0000\nDec: +30.0000\nParallax: {parallax}\n")
+        for k, elname in enumerate(ELNAME):
+            f.write(f"{elname:<4} {el[k]:.8f}\n")
+        np.savetxt(f, data['pos'], fmt=['%.5f', '%.3f', '%.5f', '%.4f'], delimiter=' ', newline=' I1\n')
+        np.savetxt(f, data['rv1'], fmt=['%.5f', '%.3f', '%.3f'], delimiter=' ', newline=' Va SYN\n')
+        np.savetxt(f, data['rv2'], fmt=['%.5f', '%.3f', '%.3f'], delimiter=' ', newline=' Vb SYN\n')
+
+
+# Write a synthetic data set in the comma-separated format
+def writecsv(fname, el, data, name='Synthetic', parallax=20.0):
+    with open(fname, 'w') as f:
+        f.write(f"Object, {name}\nRA,12.0000\nDec,30.0000\npar,{parallax}\n")
+        for k, elname in enumerate(ELNAME):
+            f.write(f"{elname},{el[k]:.8f}\n")
+        np.savetxt(f, data['rv1'], fmt=['%.5f', '%.3f', '%.3f'], delimiter=',', newline=',Va,SYN\n')
+        np.savetxt(f, data['rv2'], fmt=['%.5f', '%.3f', '%.3f'], delimiter=',', newline=',Vb,SYN\n')
+        np.savetxt(f, data['pos'], fmt=['%.5f', '%.3f', '%.5f', '%.4f'], delimiter=',', newline=',I1,SYN\n')
+
+
+# Best of `repeat` wall times of fn(), with its last return value
+def timeit(fn, repeat=3):
+    best = np.inf
+    for k in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+# Repeats per case: fewer for the large sizes
+def repeats(n):
+    return 5 if n <= 10000 else 1
+
+
+# eph() on every available backend; a first call outside the timing
+# compiles a JIT backend
+def bench_eph(sizes):
+    rows = []
+    active = ephbackend()
+    try:
+        for name in ephbackends():
+            ephbackend(name)
+            eph(TRUE_EL, TRUE_EL[1] + np.arange(3.0))
+            for n in sizes:
+                t = TRUE_EL[1] + 50 * np.random.default_rng(n).random(n)
+                for e in (0.2, 0.95, 0.99):
+                    el = TRUE_EL.copy()
+                    el[2] = e
+                    for mode, flags in (('rv', {'rv': True}), ('astrometric', {'rho': True})):
+                        sec, _ = timeit(lambda: eph(el, t, **flags), repeats(n))
+                        rows.append({'Case': f"eph[{name}] {mode} e={e}", 'N': n, 'Seconds': sec,
+                                     'Rate_per_s': n / sec})
+    finally:
+        ephbackend(active)
+    return rows
+
+
+# Largest difference of every available eph() backend from the NumPy
+# reference: all output modes, single and stacked elements, e from 0 to
+# 0.99. Position angles are compared modulo 360.
+def check_parity(n=2000, tol=1e-9):
+    rng = np.random.default_rng(5)
+    t = TRUE_EL[1] + 50 * rng.random(n)
+    rows = []
+    for name in ephbackends():
+        if name == 'numpy':
+            continue
+        fn = EPH_LOADED[name]
+        for e in (0.0, 0.2, 0.6, 0.95, 0.99):
+            el = TRUE_EL.copy()
+            el[2] = e
+            els = el + 0.01 * START_STEP * rng.standard_normal((16, 10))
+            els[:, 2] = np.clip(els[:, 2], 0, 0.995)
+            for mode, flags in (('rv', {'rv': True}), ('xy', {}), ('astrometric', {'rho': True})):
+                dev = 0.0
+                for x in (el, els):
+                    d = fn(x, t, **flags) - eph_numpy(x, t, **flags)
+                    if mode == 'astrometric':
+                        d[..., 0] = (d[..., 0] + 180) % 360 - 180
+                    dev = max(dev, float(np.max(np.abs(d))))
+                rows.append({'Backend': name, 'Mode': mode, 'e': e, 'Max_diff': dev,
+                             'Status': 'ok' if dev <= tol else 'DIFF'})
+    return pd.DataFrame(rows, columns=['Backend', 'Mode', 'e', 'Max_diff', 'Status'])
+
+
+# Fit session on a synthetic data set of n epochs: positions only (VB),
+# RVs of both components (SB2) or half of each (VB+SB2). Elements not
+# constrained by the data are fixed; the free ones start a little off the
+# truth, the same way for every size.
+def fitcase(kind, n, seed=1):
+    npos, nrv = {'VB': (n, 0), 'SB2': (0, n // 2), 'VB+SB2': (n // 2, n // 4)}[kind]
+    data = synthorbit(TRUE_EL, npos=npos, nrv1=nrv, nrv2=nrv, seed=seed)
+    fit = OrbitFit(out=io.StringIO())
+    fit.obj['name'] = f"synthetic {kind}"
+    fit.el = TRUE_EL.copy()
+    fit.fixel = np.ones(10, dtype=int)
+    if nrv == 0:
+        fit.fixel[7:10] = 0  # K1, K2, V0
+    if npos == 0:
+        fit.fixel[[3, 4, 6]] = 0  # a, W, i
+    obs = {key: rows if len(rows) else np.array([]) for key, rows in data.items()}
+    if npos > 0:
+        obs['pos'] = np.column_stack([data['pos'], np.zeros((npos, 2))])
+    fit.setobs(obs)  # RV epochs to years, like the parsers do
+    rng = np.random.default_rng(seed)
+    free = fit.fixel > 0
+    fit.el[free] += START_STEP[free] * rng.standard_normal(free.sum())
+    fit.initial_el = fit.el.copy()
+    return fit
+
+
+def bench_fit(sizes):
+    rows = []
+    for n in sizes:
+        for kind in ('VB', 'SB2', 'VB+SB2'):
+            fit = fitcase(kind, n)
+            el0 = fit.el.copy()
+
+            def run():
+                fit.el = el0.copy()
+                fit.stats = RunStats()
+                fit.fitorb()
+                return fit.el.copy()
+            sec, el = timeit(run, 1 if n > 1000 else 3)
+            # Deviation from the truth in units of the fit errors, after
+            # folding the equivalent (e, w, K) and (W, w) branches together
+            rv = kind != 'VB'
+            dev = canonel(el, TRUE_EL[1], rv) - canonel(TRUE_EL, TRUE_EL[1], rv)
+            dev[4:7] = (dev[4:7] + 180) % 360 - 180
+            free = fit.fixel > 0
+            pull = np.abs(dev[free]) / np.where(fit.elerr[free] > 0, fit.elerr[free], np.inf)
+            rows.append({'Case': f"fitorb {kind}", 'N': n, 'Seconds': sec, 'Rate_per_s': n / sec,
+                         'Max_pull': float(np.max(pull)), 'LM_nfev': fit.stats.counts['lm_nfev']})
+    return rows
+
+
+# Reference for the parse timings: the observation lines of an .inp file
+# split and converted one by one, as a plain per-line reader does
+def lineparse(fname):
+    obs = {'pos': [], 'rv1': [], 'rv2': []}
+    with open(fname) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 4 or not parts[0][0].isdigit():
+                continue
+            if 'I1' in line:
+                obs['pos'].append([float(p) for p in parts[:4]])
+            elif 'Va' in line:
+                obs['rv1'].append([float(p) for p in parts[:3]])
+            elif 'Vb' in line:
+                obs['rv2'].append([float(p) for p in parts[:3]])
+    return {key: np.array(rows) for key, rows in obs.items()}
+
+
+def bench_io(sizes, workdir):
+    rows = []
+    for n in sizes:
+        data = synthorbit(TRUE_EL, npos=n // 2, nrv1=n // 4, nrv2=n // 4, seed=2)
+        for ext, writer, reader in (('inp', writeinp, 'readinp'), ('csv', writecsv, 'readcsv_custom')):
+            fname = os.path.join(workdir, f"synth_{n}.{ext}")
+            writer(fname, TRUE_EL, data)
+            for cached in (False, True):
+                fit = OrbitFit(out=io.StringIO())
+                fit.obscache = os.path.join(workdir, 'obs_cache') if cached else None
+                if cached:
+                    getattr(fit, reader)(fname)  # fill the cache
+                sec, _ = timeit(lambda: getattr(fit, reader)(fname), repeats(n))
+                rows.append({'Case': f"parse {ext}{' (cached)' if cached else ''}", 'N': n,
+                             'Seconds': sec, 'Rate_per_s': n / sec})
+        sec, _ = timeit(lambda: lineparse(os.path.join(workdir, f"synth_{n}.inp")), repeats(n))
+        rows.append({'Case': "parse inp (per-line)", 'N': n, 'Seconds': sec, 'Rate_per_s': n / sec})
+        fit = OrbitFit(out=io.StringIO())
+        fit.obscache = None
+        fit.readinp(os.path.join(workdir, f"synth_{n}.inp"))
+        for fmt in ('csv', 'npz'):
+            outfile = os.path.join(workdir, f"synth_{n}_output.{fmt}")
+            sec, _ = timeit(lambda: fit.saveresult(outfile, fmt), repeats(n))
+            rows.append({'Case': f"orbsave {fmt}", 'N': n, 'Seconds': sec, 'Rate_per_s': n / sec})
+    return rows
+
+
+# Mass distributions of n element samples around the true elements, given
+# as an ensemble and drawn from a covariance, with a parallax error
+def bench_mass(sizes):
+    rows = []
+    cov = np.diag(START_STEP**2)
+    for n in sizes:
+        els = TRUE_EL + START_STEP * np.random.default_rng(n).standard_normal((n, 10))
+        for label, args in (('samples', (els, 20.0, 0.5)), ('cov', (TRUE_EL, 20.0, 0.5, cov, n))):
+            sec, _ = timeit(lambda: massdist(*args, seed=3), repeats(n))
+            rows.append({'Case': f"masses {label}", 'N': n, 'Seconds': sec, 'Rate_per_s': n / sec})
+    return rows
+
+
+# Shipped references whose answer is known to change on purpose, with the
+# reason; `check` allows these unless --allow is given
+KNOWN_CHANGES = {
+    'HD25811_Input.inp': "PA residual wrap (PA 353.0 at 1993.8419)",
+}
+
+
+# Refit the input of every *_output.csv in dirname with the fix flags saved
+# there, and compare with the saved tables. 'match': the same numbers of
+# positions and RVs, and every free element within tol times its saved
+# error; 'allowed': same counts, but elements differ for an input named in
+# `allow` (a known, intended change of the answer); 'DIFF': anything else.
+def check_reference(dirname, tol=0.01, allow=()):
+    rows = []
+    for ref in sorted(os.listdir(dirname)):
+        if not ref.endswith('_output.csv'):
+            continue
+        stem = os.path.join(dirname, ref[:-len('_output.csv')])
+        src = next((stem + ext for ext in ('.inp', '.csv') if os.path.exists(stem + ext)), None)
+        if src is None:
+            continue
+        res = readresult(os.path.join(dirname, ref))
+        elements = res['elements'].set_index('Parameter')
+        fit = OrbitFit(out=io.StringIO())
+        fit.obscache = None
+        if src.endswith('.csv'):
+            fit.readcsv_custom(src)
+        else:
+            fit.readinp(src)
+        fit.fixel = elements.loc[ELNAME, 'Fixed'].to_numpy().astype(int)
+        fit.fitorb()
+        val = elements.loc[ELNAME, 'Value'].to_numpy()
+        err = elements.loc[ELNAME, 'Error'].to_numpy()
+        free = fit.fixel > 0
+        dev = np.abs(fit.el - val)[free] / np.where(err[free] > 0, err[free], 1)
+        chi2_ref = float(res['stats'].set_index('Metric').loc['CHI2', 'Value'])
+        counts = tuple(fit.obj[f"n{key}"] for key in ('pos', 'rv1', 'rv2'))
+        counts_ref = tuple(len(res[key]) for key in ('pos', 'rv1', 'rv2'))
+        name = os.path.basename(src)
+        if counts != counts_ref:
+            status = 'DIFF'
+        elif np.all(dev <= tol):
+            status = 'match'
+        elif name in allow:
+            status = 'allowed'
+        else:
+            status = 'DIFF'
+        rows.append({'Input': name, 'Status': status, 'N': '/'.join(map(str, counts)),
+                     'N_ref': '/'.join(map(str, counts_ref)), 'Max_dev_sigma': float(np.max(dev)),
+                     'CHI2': fit.obj['chi2'], 'CHI2_ref': chi2_ref,
+                     'Note': KNOWN_CHANGES.get(name, '') if status == 'allowed' else ''})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks and reference checks for the orbit fit")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help="time eph, fitorb, the parsers and orbsave")
+    p.add_argument('--sizes', default='20,1000,100000,1000000', help="comma-separated numbers of epochs")
+    p.add_argument('--only', default='eph,fit,io,mass', help="subset of eph, fit, io, mass")
+    p.add_argument('--out', default=None, help="also write the results to this CSV file")
+    p = sub.add_parser('check', help="compare refits with shipped *_output.csv results")
+    p.add_argument('dirname', nargs='?', default='temp_data')
+    p.add_argument('--tol', type=float, default=0.01, help="allowed difference in units of the saved errors")
+    p.add_argument('--allow', default=','.join(KNOWN_CHANGES),
+                   help="comma-separated inputs whose elements may differ (default: the KNOWN_CHANGES)")
+    p = sub.add_parser('generate', help="write a synthetic .inp or .csv file with known elements")
+    p.add_argument('fname')
+    p.add_argument('--npos', type=int, default=20)
+    p.add_argument('--nrv', type=int, default=0, help="RVs per component")
+    p.add_argument('--e', type=float, default=TRUE_EL[2])
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('parity', help="compare the eph() backends with the NumPy reference")
+    p.add_argument('--tol', type=float, default=1e-9, help="allowed absolute difference")
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        el = TRUE_EL.copy()
+        el[2] = args.e
+        data = synthorbit(el, npos=args.npos, nrv1=args.nrv, nrv2=args.nrv, seed=args.seed)
+        (writecsv if args.fname.endswith('.csv') else writeinp)(args.fname, el, data)
+        print(f"Wrote {args.fname}: true elements " + " ".join(f"{n}={v:g}" for n, v in zip(ELNAME, el)))
+        return 0
+
+    if args.command == 'parity':
+        table = check_parity(tol=args.tol)
+        if table.empty:
+            print("Only the numpy backend is available, nothing to compare")
+            return 0
+        print(table.to_string(index=False))
+        return 1 if (table['Status'] == 'DIFF').any() else 0
+
+    if args.command == 'check':
+        table = check_reference(args.dirname, args.tol, [name for name in args.allow.split(',') if name])
+        print(table.to_string(index=False))
+        return 1 if (table['Status'] == 'DIFF').any() else 0
+
+    sizes = [int(n) for n in args.sizes.split(',')]
+    only = set(args.only.split(','))
+    rows = []
+    workdir = tempfile.mkdtemp(prefix='orbit_bench_')
+    try:
+        if 'eph' in only:
+            rows += bench_eph(sizes)
+        if 'fit' in only:
+            rows += bench_fit(sizes)
+        if 'io' in only:
+            rows += bench_io(sizes, workdir)
+        if 'mass' in only:
+            rows += bench_mass(sizes)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    table = pd.DataFrame(rows)
+    with pd.option_context('display.float_format', '{:.4g}'.format):
+        print(table.to_string(index=False))
+    if args.out:
+        table.to_csv(args.out, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# fit_cache.py
+"""
+On-disk cache of finished orbit fits for the Streamlit app.
+
+An entry is keyed by a hash of the input file content, the fixed-element
+mask and the fit settings, among them the eph() backend and the Kepler
+solver options (solversettings()), and holds everything the app shows
+after a fit: the log, elements, errors, statistics, the orbsave() table
+and the figures rendered to PNG. The cache is kept below max_bytes by
+dropping the least recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+CACHE_VERSION = 3  # bump when the fit or the stored entry layout changes
+
+
+# Cache key of one fit: input bytes, file type, fix flags and solver settings
+def fitkey(data, suffix, fixel, **settings):
+    h = hashlib.sha256(data)
+    h.update(json.dumps({'version': CACHE_VERSION, 'suffix': suffix.lower(),
+                         'fixel': [int(f) for f in fixel], 'settings': settings},
+                        sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class FitCache:
+    def __init__(self, root=os.path.join('temp_data', 'fit_cache'), max_bytes=200 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.pkl")
+
+    # Stored entry, or None; a hit marks the entry as recently used
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.drop(key)  # truncated or stale entry
+            return None
+        os.utime(path)
+        return entry
+
+    # Write atomically, so a concurrent reader never sees a partial entry
+    def put(self, key, entry):
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def drop(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    # Remove least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.pkl'):
+                try:
+                    st = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            total -= size
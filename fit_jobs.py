@@ -0,0 +1,106 @@
+# fit_jobs.py
+"""
+Background queue for orbit fits started from the Streamlit app.
+
+Jobs run on a small thread pool shared by all browser sessions, so the
+script thread only submits and polls. Every job has an id, a status and
+the latest progress report of its fit (model evaluations, cost and
+current elements). A cancelled job stops at its next progress report,
+which raises JobCancelled inside the fit. Finished jobs are kept for
+max_age seconds, so a rerun of the page can still pick up the result.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class FitJob:
+    def __init__(self, label=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.status = 'queued'  # queued, running, done, error or cancelled
+        self.nfev = 0
+        self.cost = None
+        self.el = None
+        self.log = None  # live log stream, if the job function sets one
+        self.result = None
+        self.error = ''
+        self.submitted = time.time()
+        self.finished = None
+        self.stop = threading.Event()
+
+    # Progress callback for OrbitFit(progress=...)
+    def report(self, nfev, cost, el):
+        if self.stop.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+        self.nfev = nfev
+        self.cost = cost
+        self.el = el
+
+    def cancel(self):
+        self.stop.set()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_age=3600):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='orbitfit')
+        self.max_age = max_age
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # Queue fn(job, *args); its return value becomes job.result
+    def submit(self, fn, *args, label=''):
+        job = FitJob(label)
+        with self.lock:
+            self.prune()
+            self.jobs[job.id] = job
+        self.pool.submit(self.run, job, fn, args)
+        return job.id
+
+    def run(self, job, fn, args):
+        if job.stop.is_set():
+            job.status = 'cancelled'
+        else:
+            job.status = 'running'
+            try:
+                job.result = fn(job, *args)
+                job.status = 'done'
+            except JobCancelled:
+                job.status = 'cancelled'
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = 'error'
+        job.finished = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job is not None
+
+    # Number of queued jobs submitted before job
+    def ahead(self, job):
+        with self.lock:
+            return sum(1 for other in self.jobs.values()
+                       if other.status == 'queued' and other.submitted < job.submitted)
+
+    # Forget jobs finished more than max_age seconds ago; call with the lock held
+    def prune(self):
+        now = time.time()
+        for job_id in [k for k, job in self.jobs.items()
+                       if job.finished is not None and now - job.finished > self.max_age]:
+            del self.jobs[job_id]
@@ -7,16 +7,22 @@ Original file is located at
     https://colab.research.google.com/drive/1fGOXkXoreXtIPh961LD-XD4OszZL-qdM
 """
 
+# Only NumPy and the standard library are imported here, so the model,
+# parsers, fitter and mass functions load fast in worker processes.
+# SciPy (lmfit), pandas (result tables) and matplotlib (figures) are
+# imported by the functions that use them, on first use.
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-from scipy.optimize import least_squares
-import pandas as pd
 import os
+import hashlib
+import re
+import json
+import time
+import contextvars
+import functools
+from contextlib import contextmanager
 #import tkinter as tk
 #from tkinter import filedialog, messagebox, ttk
 #from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import streamlit as st
 
 
 import sys
@@ -26,8 +32,10 @@ class OrbitData:
     def __init__(self):
         self.el = np.zeros(10)  # [P, T, e, a, W, w, i, K1, K2, V0]
         self.elerr = np.zeros(10)
+        self.cov = np.zeros((10, 10))  # covariance of the elements, zero for fixed ones
+        self.corr = np.zeros((10, 10))  # correlation matrix of the same
         self.fixel = np.ones(10, dtype=int)
-        self.elname = ['P', 'T', 'e', 'a', 'W', 'w', 'i', 'K1', 'K2', 'V0']
+        self.elname = list(ELNAME)
         self.pos = None
         self.rv1 = None
         self.rv2 = None
@@ -36,19 +44,161 @@ class OrbitData:
                     'parallax': 0.0}
         self.graph = {'mode': 0}
 
-orb = OrbitData()
-
 # Constants
 G = 2945.98  # Gravitational constant in km^3 s^-2 M_sun^-1 day^-1
-
-# Ephemeris calculation
+ELNAME = ['P', 'T', 'e', 'a', 'W', 'w', 'i', 'K1', 'K2', 'V0']  # element names, in the order of el
+
+# Run instrumentation: wall time per stage and work counters of one fit
+# session. The session's RunStats is active while one of its stages runs
+# (a context variable, so sessions in different threads count apart), and
+# eph, kepler and lmfit add to the active one. Work done in worker
+# processes (multistart, resample) is timed as a whole but not counted.
+COUNTERS = ('eph_calls', 'eph_epochs', 'ephder_calls', 'ephder_epochs',
+            'kepler_calls', 'kepler_iterations', 'kepler_updates', 'lm_nfev', 'lm_njev',
+            'model_builds')
+ACTIVE_STATS = contextvars.ContextVar('ACTIVE_STATS', default=None)
+
+class RunStats:
+    def __init__(self):
+        self.times = {}  # stage -> [runs, seconds]
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def report(self):
+        return {'stages': {name: {'calls': n, 'seconds': sec} for name, (n, sec) in self.times.items()},
+                'counters': dict(self.counts)}
+
+    def lines(self):
+        out = [f"{'Stage':<12} {'calls':>7} {'seconds':>10}"]
+        out += [f"{name:<12} {n:>7d} {sec:>10.4f}" for name, (n, sec) in self.times.items()]
+        out += [f"{name:<18} {val:>12d}" for name, val in self.counts.items()]
+        return out
+
+# Time a stage into stats, or into the active RunStats if stats is None
+# (no-op without either). Nested stages are timed separately.
+@contextmanager
+def stage(name, stats=None):
+    token = ACTIVE_STATS.set(stats) if stats is not None else None
+    stats = ACTIVE_STATS.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            entry = stats.times.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - t0
+        if token is not None:
+            ACTIVE_STATS.reset(token)
+
+def count(name, n=1):
+    stats = ACTIVE_STATS.get()
+    if stats is not None:
+        stats.counts[name] += int(n)
+
+# Method decorator: run the method as stage `name` of the session's stats
+def timed(name):
+    def wrap(method):
+        @functools.wraps(method)
+        def run(self, *args, **kwargs):
+            with stage(name, self.stats):
+                return method(self, *args, **kwargs)
+        return run
+    return wrap
+
+# Kepler solver settings, used by kepler() and the compiled eph() backend.
+# 'danby' starts from E = M + 0.85 e sign(sin M) and makes third-order
+# corrections, converging in a few iterations up to e -> 1; 'newton' is the
+# original scheme (E = M, Newton steps). Iteration stops once the last
+# correction is below KEPLER_TOL, after at most KEPLER_MAXITER iterations.
+KEPLER_METHODS = ('danby', 'newton')
+KEPLER_METHOD = 'danby'
+KEPLER_TOL = 1e-5
+KEPLER_MAXITER = 20
+
+# Kepler equation, solved for the whole epoch vector at once
+def kepler(ANM, SF, tol=None, maxiter=None, method=None):
+    """
+    Eccentric anomaly E for an array of mean anomalies ANM (radians).
+    SF is a scalar or an array broadcastable to ANM (one eccentricity per
+    element). Iterations run on all elements together; each element stops
+    updating once its own correction falls below tol, and at most maxiter
+    iterations are made. Eccentricities with |e| >= 1 (no elliptic
+    solution) or NaN give NaN without iterating. tol, maxiter and method
+    default to KEPLER_TOL, KEPLER_MAXITER and KEPLER_METHOD.
+    """
+    tol = KEPLER_TOL if tol is None else tol
+    maxiter = KEPLER_MAXITER if maxiter is None else maxiter
+    method = KEPLER_METHOD if method is None else method
+    if method not in KEPLER_METHODS:
+        raise ValueError(f"Unknown Kepler solver {method!r}, expected one of {KEPLER_METHODS}")
+    ANM = np.asarray(ANM, dtype=float)
+    shape = ANM.shape
+    ANM = ANM.ravel()
+    SF = np.broadcast_to(np.asarray(SF, dtype=float), shape).ravel()
+    E1 = np.full(ANM.size, np.nan)
+    idx = np.flatnonzero(np.abs(SF) < 1)
+    nit, nupd = 0, 0
+    if method == 'danby':
+        # Solve for M in [-pi, pi), then shift back to the cycle of ANM
+        cycle = 2 * np.pi * np.floor(ANM / (2 * np.pi) + 0.5)
+        M = ANM - cycle
+        E1[idx] = M[idx] + 0.85 * SF[idx] * np.sign(np.sin(M[idx]))
+        for it in range(maxiter):
+            if not idx.size:
+                break
+            nit += 1
+            nupd += idx.size
+            e = SF[idx]
+            E = E1[idx]
+            se = e * np.sin(E)
+            ce = e * np.cos(E)
+            f = E - se - M[idx]
+            d1 = -f / (1 - ce)
+            d2 = -f / (1 - ce + d1 * se / 2)
+            d3 = -f / (1 - ce + d2 * se / 2 + d2 * d2 * ce / 6)
+            E1[idx] = E + d3
+            idx = idx[np.abs(d3) > tol]
+        E1 += cycle
+    else:
+        E1[idx] = ANM[idx]
+        for it in range(maxiter + 1):
+            if not idx.size:
+                break
+            nit += 1
+            nupd += idx.size
+            M = ANM[idx]
+            e = SF[idx]
+            E = E1[idx]
+            En = E + (M + e * np.sin(E) - E) / (1 - e * np.cos(E))
+            E1[idx] = En
+            idx = idx[np.abs(En - E) > tol]
+    if ACTIVE_STATS.get() is not None:
+        count('kepler_calls')
+        count('kepler_iterations', nit)
+        count('kepler_updates', nupd)
+    return E1.reshape(shape)
+
+# Ephemeris calculation. el is one element vector, giving res of shape
+# (n, 2), or a stack of them of shape (m, 10), giving res of shape (m, n, 2).
+# Runs on the selected backend, see ephbackend().
 def eph(el, t, rho=False, rv=False):
-    n = len(t)
-    res = np.zeros((n, 2), dtype=float)
+    if EPH_ACTIVE is None:
+        ephbackend(EPH_BACKEND)
+    t = np.asarray(t, dtype=float)
+    el = np.asarray(el, dtype=float)
+    count('eph_calls')
+    count('eph_epochs', t.size * (len(el) if el.ndim > 1 else 1))
+    return EPH_ACTIVE[1](el, t, rho, rv)
+
+# Reference NumPy implementation of eph()
+def eph_numpy(el, t, rho=False, rv=False):
+    t = np.asarray(t, dtype=float)
+    el = np.asarray(el, dtype=float)
     pi2 = 2 * np.pi
     gr = 180 / np.pi
 
-    P, T, SF, a, W, w, i, K1, K2, V0 = el
+    P, T, SF, a, W, w, i, K1, K2, V0 = el.T[..., None] if el.ndim > 1 else el
+    SF = np.where(np.abs(SF) < 1, SF, np.nan)  # |e| >= 1: NaN model, quietly
     CF2 = 1 - SF**2
     CF = np.sqrt(CF2)
     EC = np.sqrt((1 + SF) / (1 - SF))
@@ -59,57 +209,284 @@ def eph(el, t, rho=False, rv=False):
     CI = np.cos(i / gr)
     SI = np.sin(i / gr)
 
+    phase = ((t - T) / P) % 1
+    ANM = phase * pi2
+    E1 = kepler(ANM, SF)
+    V = 2 * np.arctan(EC * np.tan(E1 / 2))
+    res = np.zeros(ANM.shape + (2,), dtype=float)
+
     if rv:
-        for i in range(n):
-            dt = t[i] - T
-            phase = (dt / P) % 1
-            if phase < 0:
-                phase += 1
-            ANM = phase * pi2
-            E = ANM
-            E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
-            while abs(E1 - E) > 1e-5:
-                E = E1
-                E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
-            V = 2 * np.arctan(EC * np.tan(E1 / 2))
-            U = V + w / gr
-            CU = np.cos(U)
-            A1 = SF * CW + CU
-            res[i, 0] = V0 + K1 * A1
-            res[i, 1] = V0 - K2 * A1
+        U = V + w / gr
+        CU = np.cos(U)
+        A1 = SF * CW + CU
+        res[..., 0] = V0 + K1 * A1
+        res[..., 1] = V0 - K2 * A1
     else:
         AA = a * (CW * CWW - SW * SWW * CI)
         BB = a * (CW * SWW + SW * CWW * CI)
         FF = a * (-SW * CWW - CW * SWW * CI)
         GG = a * (-SW * SWW + CW * CWW * CI)
-        for i in range(n):
-            dt = t[i] - T
-            phase = (dt / P) % 1
-            if phase < 0:
-                phase += 1
-            ANM = phase * pi2
-            E = ANM
-            E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
-            while abs(E1 - E) > 1e-5:
-                E = E1
-                E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
-            V = 2 * np.arctan(EC * np.tan(E1 / 2))
-            CV = np.cos(V)
-            R = CF2 / (1 + SF * CV)
-            X = R * CV
-            Y = R * np.sin(V)
-            res[i, 0] = AA * X + FF * Y
-            res[i, 1] = BB * X + GG * Y
+        CV = np.cos(V)
+        R = CF2 / (1 + SF * CV)
+        X = R * CV
+        Y = R * np.sin(V)
+        res[..., 0] = AA * X + FF * Y
+        res[..., 1] = BB * X + GG * Y
 
     if rho:
-        rho_vals = np.sqrt(res[:, 0]**2 + res[:, 1]**2)
-        theta = np.arctan2(res[:, 1], res[:, 0]) * 180 / np.pi
+        rho_vals = np.sqrt(res[..., 0]**2 + res[..., 1]**2)
+        theta = np.arctan2(res[..., 1], res[..., 0]) * 180 / np.pi
         theta = (theta + 360) % 360
-        res[:, 0] = theta
-        res[:, 1] = rho_vals
+        res[..., 0] = theta
+        res[..., 1] = rho_vals
 
     return res
 
+# Compiled eph() backend: one Numba kernel loops over elements and epochs,
+# solving Kepler's equation per epoch with the same scheme and settings as
+# kepler(); the true anomaly comes from sin E and cos E directly. Compiled
+# on the first call and cached on disk. Kepler work is not added to the
+# run counters.
+def numba_eph():
+    import numba  # ImportError when Numba is not installed
+
+    @numba.njit(cache=True, nogil=True, error_model='numpy')
+    def kernel(els, t, rho, rv, danby, tol, maxiter, res):
+        pi2 = 2 * np.pi
+        gr = 180 / np.pi
+        for k in range(els.shape[0]):
+            P, T, SF, a, W, w, i, K1, K2, V0 = els[k]
+            if not abs(SF) < 1:
+                res[k] = np.nan
+                continue
+            CF2 = 1 - SF**2
+            CF = np.sqrt(CF2)
+            CWW = np.cos(W / gr)
+            SWW = np.sin(W / gr)
+            CW = np.cos(w / gr)
+            SW = np.sin(w / gr)
+            CI = np.cos(i / gr)
+            AA = a * (CW * CWW - SW * SWW * CI)
+            BB = a * (CW * SWW + SW * CWW * CI)
+            FF = a * (-SW * CWW - CW * SWW * CI)
+            GG = a * (-SW * SWW + CW * CWW * CI)
+            for j in range(t.shape[0]):
+                phase = (t[j] - T) / P
+                ANM = (phase - np.floor(phase)) * pi2
+                if danby:
+                    M = ANM - pi2 * np.floor(ANM / pi2 + 0.5)
+                    E1 = M + 0.85 * SF * np.sign(np.sin(M))
+                    for it in range(maxiter):
+                        se = SF * np.sin(E1)
+                        ce = SF * np.cos(E1)
+                        f = E1 - se - M
+                        d1 = -f / (1 - ce)
+                        d2 = -f / (1 - ce + d1 * se / 2)
+                        d3 = -f / (1 - ce + d2 * se / 2 + d2 * d2 * ce / 6)
+                        E1 += d3
+                        if not abs(d3) > tol:
+                            break
+                else:
+                    E = ANM
+                    E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
+                    it = 0
+                    while abs(E1 - E) > tol and it < maxiter:
+                        E = E1
+                        E1 = E + (ANM + SF * np.sin(E) - E) / (1 - SF * np.cos(E))
+                        it += 1
+                CE = np.cos(E1)
+                Q = 1 - SF * CE
+                CV = (CE - SF) / Q
+                SV = CF * np.sin(E1) / Q
+                if rv:
+                    A1 = SF * CW + CV * CW - SV * SW
+                    x = V0 + K1 * A1
+                    y = V0 - K2 * A1
+                else:
+                    R = CF2 / (1 + SF * CV)
+                    x = R * (AA * CV + FF * SV)
+                    y = R * (BB * CV + GG * SV)
+                if rho:
+                    rho_val = np.sqrt(x**2 + y**2)
+                    theta = np.arctan2(y, x) * 180 / np.pi
+                    x = (theta + 360) % 360
+                    y = rho_val
+                res[k, j, 0] = x
+                res[k, j, 1] = y
+
+    def eph_numba(el, t, rho=False, rv=False):
+        t = np.asarray(t, dtype=float)
+        el = np.asarray(el, dtype=float)
+        els = np.ascontiguousarray(el.reshape(-1, 10))
+        res = np.empty((els.shape[0], t.size, 2))
+        kernel(els, np.ascontiguousarray(t.ravel()), rho, rv, KEPLER_METHOD == 'danby',
+               KEPLER_TOL, KEPLER_MAXITER, res)
+        return res.reshape(el.shape[:-1] + t.shape + (2,))
+    return eph_numba
+
+# Ephemeris backends: name -> loader returning an eph()-like function. A
+# loader imports its optional dependencies, raising ImportError when they
+# are missing. 'auto' selects the first available of EPH_AUTO. The default
+# is the numpy reference; whether the compiled loop is faster depends on
+# the machine and the array shapes, see `python benchmark.py run --only eph`.
+EPH_BACKENDS = {'numpy': lambda: eph_numpy, 'numba': numba_eph}
+EPH_AUTO = ('numba', 'numpy')
+EPH_BACKEND = os.environ.get('ORBIT_EPH_BACKEND', 'numpy')  # backend used unless ephbackend() is called
+EPH_ACTIVE = None  # (name, function) of the selected backend
+EPH_LOADED = {}
+
+# Select the eph() backend by name, or 'auto'. An unavailable backend falls
+# back to numpy with a warning. Returns the name of the selected backend;
+# without a name, returns the current one. The choice is also exported to
+# ORBIT_EPH_BACKEND, so worker processes use the same backend.
+def ephbackend(name=None):
+    global EPH_ACTIVE
+    if name is None:
+        if EPH_ACTIVE is None:
+            ephbackend(EPH_BACKEND)
+        return EPH_ACTIVE[0]
+    if name != 'auto' and name not in EPH_BACKENDS:
+        raise ValueError(f"Unknown ephemeris backend {name!r}, expected 'auto' or one of {list(EPH_BACKENDS)}")
+    for cand in (EPH_AUTO if name == 'auto' else (name, 'numpy')):
+        if cand not in EPH_LOADED:
+            try:
+                EPH_LOADED[cand] = EPH_BACKENDS[cand]()
+            except ImportError as e:
+                if cand == name:
+                    print(f"Ephemeris backend {name!r} not available ({e}), using numpy", file=sys.stderr)
+                continue
+        EPH_ACTIVE = (cand, EPH_LOADED[cand])
+        os.environ['ORBIT_EPH_BACKEND'] = name
+        return cand
+
+# Names of the backends that can be loaded here
+def ephbackends():
+    names = []
+    for name, loader in EPH_BACKENDS.items():
+        try:
+            EPH_LOADED.setdefault(name, loader())
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+# Settings that change the model values and so the fitted answer: the
+# eph() backend and the Kepler solver. JSON-serializable, for keying
+# cached fits.
+def solversettings():
+    return {'eph': ephbackend(), 'kepler': [KEPLER_METHOD, KEPLER_TOL, KEPLER_MAXITER]}
+
+# Ephemeris with analytic partial derivatives
+def ephder(el, t, rho=False, rv=False):
+    """
+    Same model as eph(), plus the closed-form partial derivatives of both
+    output columns with respect to the ten elements [P, T, e, a, W, w, i,
+    K1, K2, V0] (angles in degrees). Returns (res, der) with res of shape
+    (n, 2) and der of shape (n, 2, 10).
+    """
+    t = np.asarray(t, dtype=float)
+    n = len(t)
+    count('ephder_calls')
+    count('ephder_epochs', n)
+    res = np.zeros((n, 2), dtype=float)
+    der = np.zeros((n, 2, 10), dtype=float)
+    pi2 = 2 * np.pi
+    gr = 180 / np.pi
+
+    P, T, SF, a, W, w, i, K1, K2, V0 = el
+    SF = SF if abs(SF) < 1 else np.nan
+    CF2 = 1 - SF**2
+    EC = np.sqrt((1 + SF) / (1 - SF))
+    CWW = np.cos(W / gr)
+    SWW = np.sin(W / gr)
+    CW = np.cos(w / gr)
+    SW = np.sin(w / gr)
+    CI = np.cos(i / gr)
+    SI = np.sin(i / gr)
+
+    phase = ((t - T) / P) % 1
+    ANM = phase * pi2
+    E1 = kepler(ANM, SF)
+    V = 2 * np.arctan(EC * np.tan(E1 / 2))
+    CV = np.cos(V)
+    SV = np.sin(V)
+
+    # True anomaly: dV/dM and dV/de at fixed mean anomaly
+    dV_dM = (1 + SF * CV)**2 / CF2**1.5
+    dV_de = SV * (2 + SF * CV) / CF2
+    dM_dP = -pi2 * (t - T) / P**2
+    dM_dT = -pi2 / P
+
+    if rv:
+        U = V + w / gr
+        CU = np.cos(U)
+        SU = np.sin(U)
+        A1 = SF * CW + CU
+        dA1 = np.zeros((n, 10))
+        dA1[:, 0] = -SU * dV_dM * dM_dP
+        dA1[:, 1] = -SU * dV_dM * dM_dT
+        dA1[:, 2] = CW - SU * dV_de
+        dA1[:, 5] = (-SF * SW - SU) / gr
+        res[:, 0] = V0 + K1 * A1
+        res[:, 1] = V0 - K2 * A1
+        der[:, 0, :] = K1 * dA1
+        der[:, 1, :] = -K2 * dA1
+        der[:, 0, 7] = A1
+        der[:, 1, 8] = -A1
+        der[:, :, 9] = 1
+    else:
+        # Thiele-Innes constants per unit semi-major axis
+        A0 = CW * CWW - SW * SWW * CI
+        B0 = CW * SWW + SW * CWW * CI
+        F0 = -SW * CWW - CW * SWW * CI
+        G0 = -SW * SWW + CW * CWW * CI
+        AA, BB, FF, GG = a * A0, a * B0, a * F0, a * G0
+        Q = 1 + SF * CV
+        R = CF2 / Q
+        X = R * CV
+        Y = R * SV
+        x = AA * X + FF * Y
+        y = BB * X + GG * Y
+        res[:, 0] = x
+        res[:, 1] = y
+
+        # Derivatives of X, Y along V and along e at fixed V
+        dR_dV = CF2 * SF * SV / Q**2
+        dX_dV = dR_dV * CV - R * SV
+        dY_dV = dR_dV * SV + R * CV
+        dR_de = (-2 * SF * Q - CF2 * CV) / Q**2
+        dx_dV = AA * dX_dV + FF * dY_dV
+        dy_dV = BB * dX_dV + GG * dY_dV
+
+        der[:, 0, 0] = dx_dV * dV_dM * dM_dP
+        der[:, 1, 0] = dy_dV * dV_dM * dM_dP
+        der[:, 0, 1] = dx_dV * dV_dM * dM_dT
+        der[:, 1, 1] = dy_dV * dV_dM * dM_dT
+        der[:, 0, 2] = (AA * CV + FF * SV) * dR_de + dx_dV * dV_de
+        der[:, 1, 2] = (BB * CV + GG * SV) * dR_de + dy_dV * dV_de
+        der[:, 0, 3] = A0 * X + F0 * Y
+        der[:, 1, 3] = B0 * X + G0 * Y
+        der[:, 0, 4] = -y / gr
+        der[:, 1, 4] = x / gr
+        der[:, 0, 5] = (FF * X - AA * Y) / gr
+        der[:, 1, 5] = (GG * X - BB * Y) / gr
+        der[:, 0, 6] = a * SI * (SW * SWW * X + CW * SWW * Y) / gr
+        der[:, 1, 6] = -a * SI * (SW * CWW * X + CW * CWW * Y) / gr
+
+        if rho:
+            rho_vals = np.sqrt(x**2 + y**2)
+            theta = np.arctan2(y, x) * 180 / np.pi
+            theta = (theta + 360) % 360
+            dx = der[:, 0, :].copy()
+            dy = der[:, 1, :].copy()
+            r2 = (x**2 + y**2)[:, None]
+            der[:, 0, :] = (x[:, None] * dy - y[:, None] * dx) / r2 * gr
+            der[:, 1, :] = (x[:, None] * dx + y[:, None] * dy) / rho_vals[:, None]
+            res[:, 0] = theta
+            res[:, 1] = rho_vals
+
+    return res, der
+
 # Coordinate parsing
 def getcoord(s):
     l = s.find('.')
@@ -120,684 +497,1788 @@ def getcoord(s):
         res = -res
     return res
 
-# Time correction
+# Time correction: epochs given in years while T is a JD (or the reverse)
+# are converted to the units of T, in place
 def correct(data, t0):
     time = data[:, 0]
-    for i in range(len(time)):
-        if time[i] < 3000 and t0 > 3000:
-            data[i, 0] = 365.242198781 * (time[i] - 1900) + 15020.31352
-        elif time[i] > 3000 and t0 < 3000:
-            data[i, 0] = 1900 + (time[i] - 15020.31352) / 365.242198781
-
-# Read input file
-def readcsv_custom(fname):
-    global orb
-    orb.rv1_source = []
-    orb.rv2_source = []
-    orb.pos_source = []
-    orb.el = np.zeros(10)
-    orb.fixel = np.ones(10, dtype=int)
-    orb.elerr = np.zeros(10)
-    orb.obj = {'name': '', 'radeg': 0.0, 'dedeg': 0.0, 'npos': 0, 'nrv1': 0, 'nrv2': 0, 'rms': np.zeros(4), 'chi2n': np.zeros(4), 'chi2': 0.0, 'fname': fname, 'parallax': 0.0}
-    nmax = 1000
-    orb.pos = np.zeros((nmax, 6))
-    orb.rv1 = np.zeros((nmax, 3))
-    orb.rv2 = np.zeros((nmax, 3))
-
-    with open(fname, 'r') as f:
-        lines = f.readlines()
-
-    kpos = 0
-    krv1 = 0
-    krv2 = 0
-
-    for line in lines:
-        # Normalize line (remove BOM, whitespace)
-        line = line.lstrip('\ufeff').strip()
-        #print(f"[TRACE] Raw line: '{line}'")  # DEBUG: show each line being read
-        if not line:
+    if t0 > 3000:
+        sel = time < 3000
+        time[sel] = 365.242198781 * (time[sel] - 1900) + 15020.31352
+    elif t0 < 3000:
+        sel = time > 3000
+        time[sel] = 1900 + (time[sel] - 15020.31352) / 365.242198781
+
+# Observation arrays of the input parsers: data columns per row read from
+# the file, and total columns of the array (pos keeps two spare columns)
+OBSCOLS = {'pos': (4, 6), 'rv1': (3, 3), 'rv2': (3, 3)}
+
+# Header, element and comment lines start with something other than a
+# number. An observation line is a run of numbers followed by its tag as a
+# whole field: I1 after at least four numbers, Va (or Va+b, a blend, read
+# as rv1) or Vb after at least three; the first ncol numbers are the data
+# (OBSCOLS). Only the lines that contain a tag at all are matched against
+# the row patterns.
+HEADLINE = re.compile(r'\n[ \t]*([^-+.\d\s][^\n]*)')  # run on '\n' + text
+NUMBER = r'[-+.\d][-+.\deE]*'
+INPTAGS = {'pos': ('I1', 'I1'), 'rv1': ('Va', r'Va(?:\+b)?'), 'rv2': ('Vb', 'Vb')}
+INPROWS = {key: re.compile(rf'[ \t]*{NUMBER}(?:[ \t]+{NUMBER}){{{OBSCOLS[key][0] - 1},}}[ \t]+{tag}(?:[ \t\r]|$)')
+           for key, (_, tag) in INPTAGS.items()}
+
+# Observation lines of each type among lines
+def inprows(lines):
+    return {key: list(filter(INPROWS[key].match, [line for line in lines if lit in line]))
+            for key, (lit, _) in INPTAGS.items()}
+
+# Read the first ncol numbers of each observation line with np.loadtxt,
+# padded to width columns; no lines give an empty array
+def obsarray(lines, ncol, width, delimiter=None):
+    if not lines:
+        return np.array([])
+    vals = np.loadtxt(lines, delimiter=delimiter, usecols=range(ncol), ndmin=2)
+    if width == ncol:
+        return vals
+    obs = np.zeros((len(vals), width))
+    obs[:, :ncol] = vals
+    return obs
+
+# Parser of the .inp format. The few header and element lines are read one
+# by one; the observation lines of each type are found by inprows() and
+# read in bulk by obsarray(), so files have no row limit. As in the original
+# reader, a '*' before an element name is not recognized, so that line is
+# ignored.
+def parseinp(text, elname):
+    meta = {}
+    el = np.zeros(10)
+    fixel = np.ones(10, dtype=int)
+    for line in HEADLINE.findall('\n' + text):
+        parts = line.split()
+        key = parts[0]
+        if key[0] == 'C':
             continue
-        if line.startswith('#') or line.upper().startswith('C'):
+        if key == 'Object:':
+            meta['name'] = ' '.join(parts[1:])
+        elif key == 'RA:':
+            meta['radeg'] = 15 * getcoord(parts[1])
+        elif key == 'Dec:':
+            meta['dedeg'] = getcoord(parts[1])
+        elif key == 'Parallax:':
+            meta['parallax'] = float(parts[1])
+        elif key in elname:
+            el[elname.index(key)] = float(parts[1])
+    rows = inprows(text.splitlines())
+    obs = {key: obsarray(rows[key], *OBSCOLS[key]) for key in OBSCOLS}
+    return meta, el, fixel, obs
+
+# Parser of the comma-separated format; like parseinp(), plus the source
+# field that follows the tag of every observation. Blanks around the
+# commas are removed first, so the fields can be matched whole.
+CSVTAGS = {'pos': 'I1', 'rv1': 'Va', 'rv2': 'Vb'}
+CSVROWS = {key: re.compile(rf'[ \t]*{NUMBER}(?:,{NUMBER}){{{OBSCOLS[key][0] - 1},}},{tag},[ \t]*[^,\s]')
+           for key, tag in CSVTAGS.items()}
+
+def parsecsv(text, elname):
+    meta = {}
+    el = np.zeros(10)
+    fixel = np.ones(10, dtype=int)
+    text = text.lstrip('\ufeff')
+    for line in HEADLINE.findall('\n' + text):
+        line = line.strip()
+        if line[0] in '#Cc':
             continue
         parts = [p.strip() for p in line.split(',') if p.strip()]
-        #print(f"[TRACE] Split parts: {parts}")  # Debug output
-        if not parts:
+        if len(parts) != 2:
             continue
+        key = parts[0].lower()
+        val = parts[1]
+        if "object" in key:
+            meta['name'] = val
+        elif "ra" in key:
+            meta['radeg'] = 15 * getcoord(val)
+        elif "dec" in key:
+            meta['dedeg'] = getcoord(val)
+        elif "par" in key:
+            meta['parallax'] = float(val)
+        elif parts[0] in elname:
+            idx = elname.index(parts[0])
+            el[idx] = float(val)
+            fixel[idx] = 1
+    for blank in (' ,', '\t,', ', ', ',\t'):
+        while blank in text:
+            text = text.replace(blank, ',')
+    lines = text.splitlines()
+    obs = {}
+    sources = {}
+    for key, tag in CSVTAGS.items():
+        sep = f",{tag},"
+        rows = list(filter(CSVROWS[key].match, [line for line in lines if sep in line]))
+        obs[key] = obsarray(rows, *OBSCOLS[key], ',')
+        sources[key] = [line.partition(sep)[2].split(',', 1)[0].strip() for line in rows]
+    return meta, el, fixel, obs, sources
+
+# Binary cache of parsed datasets: one directory per source content hash
+# with pos, rv1 and rv2 (epochs already converted) and the source label
+# codes as .npy files, which load memory-mapped, and the header, elements
+# and label names in meta.json. The cache is kept below OBSCACHE_BYTES by
+# dropping the least recently used entries.
+OBSCACHE_VERSION = 5  # bump when the parsers or the layout change
+OBSCACHE_BYTES = 200 * 2**20
+
+def obskey(raw, kind):
+    h = hashlib.sha256(raw)
+    h.update(f"{kind}:{OBSCACHE_VERSION}".encode())
+    return h.hexdigest()
+
+# Cached (meta, el, fixel, obs, sources) of key, or None. The arrays are
+# copy-on-write maps of the files, so they are not read into memory.
+def loadobs(root, key):
+    path = os.path.join(root, key)
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            info = json.load(f)
+        obs = {}
+        sources = {} if info['labels'] is not None else None
+        for k in OBSCOLS:
+            if info['n'][k] == 0:
+                obs[k] = np.array([])
+            else:
+                obs[k] = np.load(os.path.join(path, f"{k}.npy"), mmap_mode='c')
+            if sources is not None:
+                labels = np.array(info['labels'][k], dtype=object)
+                codes = np.load(os.path.join(path, f"{k}_source.npy")) if info['n'][k] else []
+                sources[k] = labels[codes].tolist() if len(labels) else []
+    except (OSError, ValueError, KeyError):
+        return None  # missing or incomplete entry
+    try:
+        os.utime(path)  # recently used
+    except OSError:
+        pass
+    return info['meta'], np.array(info['el']), np.array(info['fixel'], dtype=int), obs, sources
 
-        # Metadata and elements
-        if len(parts) == 2:
-            key = parts[0].strip().lower()
-            #print(key)  # Debug output
-            val = parts[1].strip()
-            if "object" in key:
-                orb.obj['name'] = val
-            elif "ra" in key:
-                orb.obj['radeg'] = 15 * getcoord(val)
-            elif "dec" in key:
-                orb.obj['dedeg'] = getcoord(val)
-            elif "par" in key:
-                orb.obj['parallax'] = float(val)
-                #print(f"DEBUG: Parallax read = {orb.obj['parallax']}")
-            elif parts[0] in orb.elname:
-                idx = orb.elname.index(parts[0])
-                orb.el[idx] = float(parts[1])
-                orb.fixel[idx] = 1
+# Write one cache entry. It is assembled in a scratch directory and renamed
+# into place, so concurrent readers and writers never see a partial entry.
+def saveobs(root, key, meta, el, fixel, obs, sources=None):
+    path = os.path.join(root, key)
+    if os.path.isdir(path):
+        return
+    os.makedirs(root, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    info = {'meta': meta, 'el': [float(x) for x in el], 'fixel': [int(x) for x in fixel],
+            'n': {k: len(obs[k]) for k in OBSCOLS}, 'labels': None}
+    if sources is not None:
+        info['labels'] = {}
+    for k in OBSCOLS:
+        if len(obs[k]):
+            np.save(os.path.join(tmp, f"{k}.npy"), np.asarray(obs[k]))
+        if sources is not None:
+            labels, codes = np.unique(np.array(sources[k], dtype=str), return_inverse=True)
+            info['labels'][k] = labels.tolist()
+            if len(obs[k]):
+                np.save(os.path.join(tmp, f"{k}_source.npy"), codes.astype(np.int32))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(info, f)
+    try:
+        os.rename(tmp, path)
+    except OSError:  # written meanwhile by another process
+        for name in os.listdir(tmp):
+            os.remove(os.path.join(tmp, name))
+        os.rmdir(tmp)
+    evictobs(root)
+
+# Remove least recently used cache entries until the cache fits in max_bytes.
+# Readers of a removed entry keep their memory maps; a concurrent load of
+# it fails as a cache miss.
+def evictobs(root, max_bytes=OBSCACHE_BYTES):
+    entries = []
+    for key in os.listdir(root):
+        path = os.path.join(root, key)
+        if key.endswith('.tmp'):
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((os.stat(path).st_mtime, size, path))
+        except OSError:
             continue
-        # RV1 (Va)
-        if parts[-2] == "Va" and len(parts) >= 5:
-            orb.rv1[krv1, 0:3] = [float(parts[0]), float(parts[1]), float(parts[2])]
-            orb.rv1_source.append(parts[4])  # COR, for example
-            krv1 += 1
-
-        # RV2 (Vb)
-        elif parts[-2] == "Vb" and len(parts) >= 5:
-            orb.rv2[krv2, 0:3] = [float(parts[0]), float(parts[1]), float(parts[2])]
-            orb.rv2_source.append(parts[4])
-            krv2 += 1
-
-        # POS (I1)
-        elif parts[-2] == "I1" and len(parts) >= 6:
-            orb.pos[kpos, 0:4] = [float(parts[0]), float(parts[1]), float(parts[2]), float(parts[3])]
-            orb.pos_source.append(parts[5])
-            kpos += 1
-    #print(f"DEBUG: Parallax read = {orb.obj['parallax']}")
-
-
-    # Truncate arrays
-    orb.rv1 = orb.rv1[:krv1, :] if krv1 > 0 else np.array([])
-    orb.rv2 = orb.rv2[:krv2, :] if krv2 > 0 else np.array([])
-    orb.pos = orb.pos[:kpos, :] if kpos > 0 else np.array([])
-    orb.obj['nrv1'] = krv1
-    orb.obj['nrv2'] = krv2
-    orb.obj['npos'] = kpos
-
-    if krv1 > 0:
-        correct(orb.rv1, orb.el[1])
-    if krv2 > 0:
-        correct(orb.rv2, orb.el[1])
-    if kpos > 0:
-        correct(orb.pos, orb.el[1])
-
-    orb.graph['mode'] = 1 if (krv1 > 0 or krv2 > 0) else 0
-    # HM: ─── save the *initial* elements for later overlay & printing ───
-    orb.initial_el = orb.el.copy()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+        except OSError:
+            pass
+        total -= size
+
+# Model values for all observations, one eph() call per block. A stack of
+# element vectors (m, 10) gives one row of model values per vector.
+def allmodel(el, blocks, n):
+    y1 = np.zeros(np.shape(el)[:-1] + (n,))
+    for t, flags, cols in blocks:
+        res = eph(el, t, **flags)
+        for col, sl in cols:
+            y1[..., sl] = res[..., col]
+    return y1
+
+# Model derivatives for all observations, one ephder() call per block
+def alljac(el, blocks, n, selfit):
+    J = np.zeros((n, len(selfit)))
+    for t, flags, cols in blocks:
+        der = ephder(el, t, **flags)[1]
+        for col, sl in cols:
+            J[sl] = der[:, col, selfit]
+    return J
+
+# Levenberg-Marquardt fit of the free elements (fixel > 0), starting from el.
+# progress(nfev, cost, el), if given, is called after every model evaluation
+# with cost = chi2 / 2; an exception raised by it aborts the fit.
+# Position angle residuals are wrapped into [-180, 180). A trial step where
+# the model is not finite (e.g. |e| >= 1) gets large finite residuals, so
+# LM rejects it and shrinks the step; a start of that kind still raises
+# ValueError.
+def lmfit(el, fixel, blocks, yy, err, verbose=0, progress=None):
+    from scipy.optimize import least_squares
+    n = len(yy)
+    selfit = np.where(fixel > 0)[0]
+    el0 = np.array(el, dtype=float)
+    wrap = np.zeros(n, dtype=bool)
+    for t, flags, cols in blocks:
+        if flags.get('rho'):
+            wrap[cols[0][1]] = True
+    nfev = [0]
+    def residuals(params):
+      el0[selfit] = params
+      with stage('residuals'):
+        d = yy - allmodel(el0, blocks, n)
+        d[wrap] = (d[wrap] + 180) % 360 - 180
+        f = d / err
+      nfev[0] += 1
+      if progress is not None:
+        progress(nfev[0], 0.5 * np.sum(f**2), el0.copy())
+      if nfev[0] > 1:
+        f[~np.isfinite(f)] = 1e8
+      return f
+    def jacobian(params):
+      el0[selfit] = params
+      with stage('jacobian'):
+        return -alljac(el0, blocks, n, selfit) / err[:, None]
+    result = least_squares(residuals, el0[selfit], jac=jacobian, method='lm', max_nfev=1000, ftol=1e-10, xtol=1e-10, verbose=verbose)
+    count('lm_nfev', result.nfev)
+    count('lm_njev', result.njev or 0)
+    return result
+
+# Covariance of the free elements from the Jacobian J of the weighted
+# residuals at the solution, scaled by the reduced chi2 chi2n. The columns
+# of J are scaled to unit norm and J is pseudo-inverted by SVD, dropping
+# singular values below rcond times the largest, so an ill-conditioned fit
+# still gives finite errors for the determined elements. Elements with a
+# component of more than sqrt(rcond) in a dropped singular vector (among
+# them those the data do not depend on at all) are not determined: their
+# rows and columns of the covariance are NaN. Returns the covariance, the
+# condition number of the scaled J^T J and the number of singular values
+# kept.
+def covariance(J, chi2n=1.0, rcond=1e-8):
+    norm = np.sqrt(np.sum(J**2, axis=0))
+    norm = np.where(norm > 0, norm, 1)
+    U, s, Vt = np.linalg.svd(J / norm, full_matrices=False)
+    keep = s > rcond * s[0]
+    V = Vt[keep].T / s[keep]
+    cov = (V @ V.T) / np.outer(norm, norm) * chi2n
+    null = np.any(np.abs(Vt[~keep]) > np.sqrt(rcond), axis=0)
+    cov[null, :] = np.nan
+    cov[:, null] = np.nan
+    cond = (s[0] / s[-1])**2 if s[-1] > 0 else np.inf
+    return cov, cond, int(keep.sum())
+
+# Correlation matrix of a covariance matrix; rows of zero variance stay zero
+def correlation(cov):
+    sd = np.sqrt(np.diag(cov))
+    inv = np.where(sd > 0, 1 / np.where(sd > 0, sd, 1), 0)
+    return cov * np.outer(inv, inv)
+
+# One start of a multi-start fit; module level so worker processes can run it
+def lmstart(task):
+    el, fixel, blocks, yy, err = task
+    selfit = np.where(fixel > 0)[0]
+    try:
+        result = lmfit(el, fixel, blocks, yy, err)
+    except ValueError:
+        return None  # model not finite at this start
+    if not np.all(np.isfinite(result.fun)):
+        return None
+    el1 = np.array(el, dtype=float)
+    el1[selfit] = result.x
+    return el1, float(np.sum(result.fun**2)), result.nfev
+
+# Integrated autocorrelation time of an MCMC chain (nsteps, nwalkers, ndim),
+# one value per parameter. The autocorrelation function is averaged over
+# walkers and summed up to the first window M with M >= c * tau(M).
+def autocorr(chain, c=5):
+    nsteps = chain.shape[0]
+    x = chain - chain.mean(axis=0)
+    nfft = 1 << (2 * nsteps - 1).bit_length()
+    f = np.fft.rfft(x, n=nfft, axis=0)
+    acf = np.fft.irfft(f * np.conj(f), n=nfft, axis=0)[:nsteps]
+    acf = acf / np.where(acf[0] > 0, acf[0], 1)
+    acf = acf.mean(axis=1)
+    taus = 2 * np.cumsum(acf, axis=0) - 1
+    tau = np.zeros(chain.shape[2])
+    for j in range(chain.shape[2]):
+        m = np.flatnonzero(np.arange(nsteps) >= c * taus[:, j])
+        tau[j] = taus[m[0] if m.size else -1, j]
+    return tau
+
+# Split Gelman-Rubin R-hat of a chain (nsteps, nwalkers, ndim): every walker
+# is cut in two halves, and the within- and between-chain variances compared.
+def rhat(chain):
+    half = chain.shape[0] // 2
+    x = np.concatenate([chain[:half], chain[half:2*half]], axis=1)
+    W = x.var(axis=0, ddof=1).mean(axis=0)
+    B = half * x.mean(axis=0).var(axis=0, ddof=1)
+    var = (half - 1) / half * W + B / half
+    return np.sqrt(var / np.where(W > 0, W, np.inf))
+
+# Fold equivalent element sets onto one representation: K1 >= 0 (or K2 >= 0
+# when K1 = 0), e >= 0, a >= 0, 0 <= i <= 180, angles in [0, 360) and T in
+# the cycle nearest Tref. (W, w, K1, K2) and (W + 180, w + 180, -K1, -K2)
+# give the same orbit and RVs. Without RV data (W, w) and (W + 180, w + 180)
+# give the same orbit, and W is taken in [0, 180).
+def canonel(el, Tref, rv=True):
+    el = np.array(el, dtype=float)
+    if el[7] < 0 or (el[7] == 0 and el[8] < 0):
+        el[7:9] = -el[7:9]
+        el[4] += 180
+        el[5] += 180
+    if el[2] < 0:
+        el[2] = -el[2]
+        el[5] += 180
+        el[1] += el[0] / 2
+    if el[3] < 0:
+        el[3] = -el[3]
+        el[4] += 180
+    el[6] %= 360
+    if el[6] > 180:
+        el[6] = 360 - el[6]
+    el[4] %= 360
+    el[5] %= 360
+    if not rv and el[4] >= 180:
+        el[4] -= 180
+        el[5] = (el[5] + 180) % 360
+    if el[0] != 0:
+        el[1] -= el[0] * np.round((el[1] - Tref) / el[0])
+    return el
+
+# Fold el with canonel() onto the branch of the reference solution ref:
+# of the equivalent sets (W, w, K1, K2) and (W + 180, w + 180, -K1, -K2)
+# (K1, K2 unchanged without RV data), the one nearer to ref, with W and w
+# then taken within 180 degrees of ref and T in the cycle nearest ref's.
+def foldto(el, ref, rv=True):
+    ref = np.asarray(ref, dtype=float)
+    el = canonel(el, ref[1], rv)
+    alt = el.copy()
+    alt[4:6] += 180
+    if rv:
+        alt[7:9] = -alt[7:9]
+    def dist(x):
+        d = (x[4:6] - ref[4:6] + 180) % 360 - 180
+        return np.sum((d / 180)**2) + np.sum(((x[7:9] - ref[7:9]) / np.maximum(np.abs(ref[7:9]), 1))**2)
+    if dist(alt) < dist(el):
+        el = alt
+    el[4:6] = ref[4:6] + (el[4:6] - ref[4:6] + 180) % 360 - 180
+    return el
+
+# Group solutions whose elements agree to xtol (relative to a per-element
+# scale); returns one entry per distinct minimum, ranked by chi2. The folded
+# elements ('el') are only for comparison; 'raw' keeps the best solution of
+# each minimum as fitted, so fixed elements keep their values.
+def uniqsol(sols, Tref, xtol=1e-3, rv=True):
+    minima = []
+    for raw, chi2, nfev in sorted(sols, key=lambda sol: sol[1]):
+        el = canonel(raw, Tref, rv)
+        scale = np.array([el[0], el[0], 1, max(abs(el[3]), 1e-3), 360, 360, 360,
+                          max(abs(el[7]), 1), max(abs(el[8]), 1), max(abs(el[9]), 1)])
+        for m in minima:
+            d = np.abs(el - m['el'])
+            d[4:7] = np.minimum(d[4:7], 360 - d[4:7])
+            if np.all(d <= xtol * scale):
+                m['count'] += 1
+                break
+        else:
+            minima.append({'el': el, 'raw': np.array(raw, dtype=float), 'chi2': chi2, 'nfev': nfev, 'count': 1})
+    return minima
+
+# Solve the weighted linear fit RV = V0 + A_k c + B_k s (one A, B pair per
+# component k) from its sums. S has shape (5, G, 2, ncomp): the sums of c, s,
+# c^2, c s and s^2 weighted by w (S[:, :, 0]) and by w y (S[:, :, 1]) for
+# each component. Returns chi2 (G,) and the coefficients (G, 1 + 2 * ncomp).
+def rvsolve(S, sw, swy, swyy):
+    G, ncomp = S.shape[1], S.shape[3]
+    p = 1 + 2 * ncomp
+    A = np.zeros((G, p, p))
+    b = np.zeros((G, p))
+    A[:, 0, 0] = sw
+    b[:, 0] = swy
+    ka, kb = np.arange(1, p, 2), np.arange(2, p, 2)
+    A[:, 0, ka] = A[:, ka, 0] = S[0, :, 0]
+    A[:, 0, kb] = A[:, kb, 0] = S[1, :, 0]
+    A[:, ka, ka] = S[2, :, 0]
+    A[:, ka, kb] = A[:, kb, ka] = S[3, :, 0]
+    A[:, kb, kb] = S[4, :, 0]
+    b[:, ka] = S[0, :, 1]
+    b[:, kb] = S[1, :, 1]
+    # Tiny ridge keeps aliased trial frequencies (c, s collinear) solvable
+    A += 1e-10 * np.trace(A, axis1=1, axis2=2)[:, None, None] * np.eye(p)
+    coef = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    chi2 = swyy - np.sum(coef * b, axis=1)
+    return chi2, coef
+
+# Default frequency grid for RV epochs t: periods from 3x the time span
+# down to twice the median sampling step, oversampled 5x, at most nmax points
+def freqgrid(t, oversample=5, nmax=100000):
+    t = np.sort(np.asarray(t, dtype=float))
+    span = t[-1] - t[0]
+    dt = np.diff(t)
+    dt = np.median(dt[dt > 0]) if np.any(dt > 0) else span
+    fmin = 1 / (3 * span)
+    fmax = 1 / (2 * dt)
+    nf = int(min(max((fmax - fmin) * span * oversample, 10), nmax))
+    return np.linspace(fmin, fmax, nf)
+
+# Sums sum_n h_n exp(2 pi i f_k t_n) on the uniform grid f_k = f0 + k df,
+# k < nf, in O(N log N): h is spread onto a regular grid with order-point
+# Lagrange weights (Press & Rybicki 1989) and transformed with one FFT.
+def trigsum(t, h, f0, df, nf, oversample=16, order=8):
+    t0 = t.min()
+    nfft = 1 << int(np.ceil(np.log2(nf * oversample)))
+    h = h * np.exp(2j * np.pi * f0 * (t - t0))
+    x = ((t - t0) * nfft * df) % nfft
+    ilo = np.floor(x).astype(np.int64) - order // 2 + 1
+    nodes = ilo[:, None] + np.arange(order)
+    dx = x[:, None] - nodes
+    exact = np.isclose(dx, 0)
+    dx[exact] = 1
+    lag = np.prod(dx, axis=1)[:, None] / dx
+    j = np.arange(order)
+    denom = np.array([np.prod([jj - k for k in j if k != jj]) for jj in j], dtype=float)
+    lag = lag / denom
+    hit = exact.any(axis=1)
+    lag[hit] = exact[hit]
+    lag = lag * h[:, None]
+    nodes %= nfft
+    grid = (np.bincount(nodes.ravel(), lag.real.ravel(), nfft)
+            + 1j * np.bincount(nodes.ravel(), lag.imag.ravel(), nfft))
+    res = np.fft.ifft(grid)[:nf] * nfft
+    return res * np.exp(2j * np.pi * (f0 + df * np.arange(nf)) * t0)
+
+# Generalized (floating mean, weighted) Lomb-Scargle periodogram. comp marks
+# each point as primary (0) or secondary (1); components get separate
+# amplitudes and share V0. Returns the power 1 - chi2 / chi2_const.
+# Uniform grids use FFT trig sums; other grids are evaluated directly.
+def lombscargle(t, y, dy, freq, comp=None, chunk=2000):
+    t, y, freq = np.asarray(t, dtype=float), np.asarray(y, dtype=float), np.asarray(freq, dtype=float)
+    w = 1 / np.asarray(dy, dtype=float)**2
+    comp = np.zeros(len(t), dtype=int) if comp is None else np.asarray(comp)
+    ncomp = int(comp.max()) + 1
+    Wk = w[:, None] * (comp[:, None] == np.arange(ncomp))
+    sw, swy, swyy = np.sum(w), np.sum(w * y), np.sum(w * y**2)
+    chi0 = swyy - swy**2 / sw
+    nf = len(freq)
+    S = np.zeros((5, nf, 2, ncomp))
+    uniform = nf > 2 and np.allclose(np.diff(freq), freq[1] - freq[0])
+    if uniform and len(t) * nf > 1e6:
+        df = freq[1] - freq[0]
+        for k in range(ncomp):
+            z1 = trigsum(t, Wk[:, k], freq[0], df, nf)
+            z2 = trigsum(t, Wk[:, k], 2 * freq[0], 2 * df, nf)
+            zy = trigsum(t, Wk[:, k] * y, freq[0], df, nf)
+            swk = np.sum(Wk[:, k])
+            S[0, :, 0, k] = z1.real
+            S[1, :, 0, k] = z1.imag
+            S[2, :, 0, k] = (swk + z2.real) / 2
+            S[3, :, 0, k] = z2.imag / 2
+            S[4, :, 0, k] = (swk - z2.real) / 2
+            S[0, :, 1, k] = zy.real
+            S[1, :, 1, k] = zy.imag
+    else:
+        H = np.hstack([Wk, Wk * y[:, None]])
+        for k in range(0, nf, chunk):
+            arg = 2 * np.pi * np.outer(freq[k:k+chunk], t)
+            c, s = np.cos(arg), np.sin(arg)
+            X = np.stack([c, s, c * c, c * s, s * s]).reshape(5 * len(c), -1)
+            S[:, k:k+chunk] = (X @ H).reshape(5, len(c), 2, ncomp)
+    power = np.zeros(nf)
+    for k in range(0, nf, chunk * 10):
+        chi2 = rvsolve(S[:, k:k+chunk*10], sw, swy, swyy)[0]
+        power[k:k+chunk*10] = 1 - chi2 / chi0
+    return power
+
+# Keplerian periodogram: for every trial frequency, the best fit over the
+# eccentricity grid egrid and nphase trial periastron phases, with V0 and
+# K cos(w), K sin(w) of each component solved linearly. The weights are
+# binned into ntab mean-anomaly bins per frequency, and the sums come from
+# one matrix product with tabulated anomalies, so no Kepler equation is
+# solved on the grid. The binning still costs O(nf * N) for N epochs; only
+# the products and solves, O(nf * ntab * len(egrid) * nphase), do not grow
+# with N. By default chunk holds about 4e6 (frequency, epoch) pairs, so the
+# binning arrays stay bounded for long series.
+# Returns the power and, per frequency, the best e, phase and coefficients.
+def keplerogram(t, y, dy, freq, comp=None, egrid=(0.0, 0.2, 0.4, 0.6, 0.8),
+                nphase=8, ntab=256, chunk=None):
+    t, y, freq = np.asarray(t, dtype=float), np.asarray(y, dtype=float), np.asarray(freq, dtype=float)
+    w = 1 / np.asarray(dy, dtype=float)**2
+    comp = np.zeros(len(t), dtype=int) if comp is None else np.asarray(comp)
+    ncomp = int(comp.max()) + 1
+    sw, swy, swyy = np.sum(w), np.sum(w * y), np.sum(w * y**2)
+    chi0 = swyy - swy**2 / sw
+    nf = len(freq)
+    if chunk is None:
+        chunk = int(np.clip(4_000_000 // max(len(t), 1), 1, 1000))
+    best = np.full(nf, np.inf)
+    best_e = np.zeros(nf)
+    best_ph = np.zeros(nf)
+    best_coef = np.zeros((nf, 1 + 2 * ncomp))
+
+    # Tables of c = e + cos V, s = -sin V and their products over the mean
+    # anomaly bins, one column per (quantity, phase shift)
+    ntab -= ntab % nphase
+    Mtab = 2 * np.pi * (np.arange(ntab) + 0.5) / ntab
+    shift = np.arange(nphase) * (ntab // nphase)
+    roll = (np.arange(ntab)[:, None] - shift[None, :]) % ntab
+    tabs = []
+    for e in egrid:
+        E = kepler(Mtab, e)
+        V = 2 * np.arctan(np.sqrt((1 + e) / (1 - e)) * np.tan(E / 2))
+        c, s = e + np.cos(V), -np.sin(V)
+        tab = np.stack([c, s, c * c, c * s, s * s])
+        tabs.append((e, tab[:, roll].transpose(1, 0, 2).reshape(ntab, 5 * nphase)))
+
+    for k in range(0, nf, chunk):
+        f = freq[k:k+chunk]
+        nc = len(f)
+        bins = np.floor((np.outer(f, t) % 1) * ntab).astype(np.int64)
+        flat = ((np.arange(nc)[:, None] * ncomp + comp) * ntab + bins).ravel()
+        size = nc * ncomp * ntab
+        Hw = np.bincount(flat, np.tile(w, nc), size).reshape(nc, 1, ncomp, ntab)
+        Hy = np.bincount(flat, np.tile(w * y, nc), size).reshape(nc, 1, ncomp, ntab)
+        H = np.concatenate([Hw, Hy], axis=1).reshape(nc * 2 * ncomp, ntab)
+        for e, tab in tabs:
+            S = (H @ tab).reshape(nc, 2, ncomp, 5, nphase)
+            S = S.transpose(3, 0, 4, 1, 2).reshape(5, nc * nphase, 2, ncomp)
+            chi2, coef = rvsolve(S, sw, swy, swyy)
+            chi2 = chi2.reshape(nc, nphase)
+            j = np.argmin(chi2, axis=1)
+            c2 = chi2[np.arange(nc), j]
+            better = c2 < best[k:k+nc]
+            sl = np.arange(k, k + nc)[better]
+            best[sl] = c2[better]
+            best_e[sl] = e
+            best_ph[sl] = 2 * np.pi * shift[j[better]] / ntab
+            best_coef[sl] = coef.reshape(nc, nphase, -1)[better, j[better]]
+    return 1 - best / chi0, best_e, best_ph, best_coef
+
+# Calculate total mass. Elements and parallax may be arrays (broadcast
+# together); the mass is 0 where the parallax is not positive.
+def calculate_total_mass(P, a, parallax):
+    P, a, parallax = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (P, a, parallax)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance_pc = 1000.0 / parallax
+        a_au = a * distance_pc
+        total_mass = (a_au**3) / (P**2)
+    return np.where(parallax > 0, total_mass, 0.0)[()]
+
+# Calculate spectroscopic masses, for scalar or array elements. All three
+# are 0 where K1 = K2 = 0; M2 is 0 (and M1 the total) where K2 = 0.
+def calculate_spectroscopic_masses(P, e, i, K1, K2):
+    P, e, i, K1, K2 = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (P, e, i, K1, K2)))
+    none = (K1 == 0) & (K2 == 0)
+    double = K2 != 0
 
-def readinp(fname):
-    global orb
-    orb.el = np.zeros(10)
-    orb.fixel = np.ones(10, dtype=int)
-    nmax = 500
-    orb.pos = np.zeros((nmax, 6))
-    orb.rv1 = np.zeros((nmax, 3))
-    orb.rv2 = np.zeros((nmax, 3))
-    orb.obj['fname'] = fname
-
-    if not os.path.exists(fname):
-        print(f"File {fname} not found")
-        orb.obj['fname'] = ''
-        return
+    i_rad = np.radians(i)
+    sin_i = np.sin(i_rad)
+    sin3_i = sin_i**3
+    K_sum = K1 + K2
 
-    with open(fname, 'r') as f:
-        lines = f.readlines()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # M(1+2) * sin^3(i) in solar masses
+        M12_sin3i = (K_sum**3 * P * (1 - e**2)**(3/2)) / (2 * np.pi * G)
+        M_total = M12_sin3i / sin3_i
+        q = K1 / np.where(double, K2, 1.0)
+        M1 = np.where(double, M_total / (1 + q), M_total)
+        M2 = np.where(double, q * M1, 0.0)
+
+    return tuple(np.where(none, 0.0, m)[()] for m in (M12_sin3i, M1, M2))
+
+# Derived masses of element arrays el (..., 10) at parallax (mas, broadcast
+# against el[..., 0]): (..., 4) columns MASSNAMES
+MASSNAMES = ('Mtot', 'M(1+2)sin3i', 'M1', 'M2')
+
+def orbmasses(el, parallax):
+    el = np.asarray(el, dtype=float)
+    return np.stack([calculate_total_mass(el[..., 0], el[..., 3], parallax)] +
+                    list(calculate_spectroscopic_masses(el[..., 0], el[..., 2], el[..., 6],
+                                                        el[..., 7], el[..., 8])), axis=-1)
+
+# Mass distributions in one vectorized pass. el is an (N, 10) ensemble of
+# element samples, or one element vector with its covariance cov, from
+# which nsamples are drawn; the parallax gets Gaussian noise of
+# parallax_err (mas). Samples with e outside [0, 1) or a parallax <= 0
+# give NaN masses, which the summary leaves out; without a parallax
+# (parallax <= 0) no parallax is drawn and Mtot is NaN for every sample.
+# Returns the (N, 4) masses and their masssummary().
+def massdist(el, parallax, parallax_err=0.0, cov=None, nsamples=100000, seed=None):
+    rng = np.random.default_rng(seed)
+    el = np.asarray(el, dtype=float)
+    if cov is not None:
+        el = rng.multivariate_normal(el, cov, size=nsamples, method='eigh')
+    el = np.atleast_2d(el)
+    if parallax > 0 and parallax_err > 0:
+        plx = parallax + parallax_err * rng.standard_normal(len(el))
+    else:
+        plx = parallax
+    masses = orbmasses(el, plx)
+    masses[(el[:, 2] < 0) | (el[:, 2] >= 1)] = np.nan
+    masses[np.broadcast_to(plx, len(el)) <= 0, 0] = np.nan
+    return masses, masssummary(masses)
+
+# Median, standard deviation, 68% and 95% intervals of each mass column,
+# over the finite samples: {name: {'n', 'mean', 'std', '2.5%', ...}}
+def masssummary(masses):
+    summary = {}
+    for name, m in zip(MASSNAMES, np.asarray(masses).T):
+        m = m[np.isfinite(m)]
+        pct = np.percentile(m, [2.5, 16, 50, 84, 97.5]) if len(m) else np.full(5, np.nan)
+        summary[name] = {'n': len(m), 'mean': m.mean() if len(m) else np.nan,
+                         'std': m.std(ddof=1) if len(m) > 1 else np.nan,
+                         **dict(zip(['2.5%', '16%', '50%', '84%', '97.5%'], pct))}
+    return summary
+
+# Tables of an orbsave() result and their section titles in the CSV format
+RESULT_TABLES = {'elements': 'Orbital Elements', 'pos': 'Position Measurements',
+                 'rv1': 'Primary RV Measurements', 'rv2': 'Secondary RV Measurements',
+                 'stats': 'Statistics', 'covariance': 'Covariance Matrix',
+                 'correlation': 'Correlation Matrix'}
+RESULT_FORMATS = ('csv', 'npz')
+
+# Read one orbsave() result, .csv or .npz. Returns {table: DataFrame} for
+# the RESULT_TABLES (empty when absent) and 'meta', a dict with Object, RA,
+# Dec and Parallax.
+def readresult(fname):
+    import pandas as pd
+    tables = {key: pd.DataFrame() for key in RESULT_TABLES}
+    meta = {}
+    if fname.endswith('.npz'):
+        with np.load(fname, allow_pickle=False) as data:
+            cols = {key: {} for key in list(RESULT_TABLES) + ['meta']}
+            for name in data.files:
+                key, col = name.split('/', 1)
+                if key in cols:
+                    cols[key][col] = data[name]
+        meta = {col: val.item() for col, val in cols.pop('meta').items()}
+        for key, c in cols.items():
+            if c:
+                tables[key] = pd.DataFrame(c)
+    else:
+        # Line by line, as files saved on Windows can have blank lines
+        # between the rows of a table
+        titles = {title: key for key, title in RESULT_TABLES.items()}
+        headers = {'Object': 'Object', 'RA': 'RA', 'Dec': 'Dec', 'Parallax (mas)': 'Parallax'}
+        rows = {}
+        key = None
+        with open(fname, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith('#'):
+                    title = line.lstrip('# ')
+                    key = titles.get(title)
+                    if key is not None:
+                        rows[key] = []
+                    field, _, val = title.partition(': ')
+                    if field in headers:
+                        meta[headers[field]] = val if field == 'Object' else float(val)
+                elif key is not None:
+                    rows[key].append(line)
+        for key, lines in rows.items():
+            if len(lines) > 1:
+                tables[key] = pd.read_csv(io.StringIO('\n'.join(lines)))
+    tables['meta'] = meta
+    return tables
+
+# Read every orbsave() result under path (a directory, or a list of files)
+# into one catalog table with a row per system: header fields, observation
+# counts, elements with their errors and fix flags, and the statistics.
+def loadresults(path, pattern='_output'):
+    import pandas as pd
+    if isinstance(path, str):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if pattern in f and f.endswith(tuple(f".{fmt}" for fmt in RESULT_FORMATS)))
+    else:
+        files = list(path)
+    rows = []
+    for fname in files:
+        res = readresult(fname)
+        meta = res['meta']
+        row = {'File': fname, 'Object': meta.get('Object', ''), 'RA': meta.get('RA', np.nan),
+               'Dec': meta.get('Dec', np.nan), 'Npos': len(res['pos']),
+               'Nrv1': len(res['rv1']), 'Nrv2': len(res['rv2'])}
+        for name, val, err, fixed in res['elements'][['Parameter', 'Value', 'Error', 'Fixed']].itertuples(index=False):
+            row[name] = val
+            row[f"{name}_Err"] = err
+            row[f"{name}_Fixed"] = int(fixed == 0)
+        if not res['stats'].empty:
+            row.update(zip(res['stats']['Metric'], res['stats']['Value']))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+# Figure with its own Agg canvas: drawing never needs pyplot or a GUI backend
+def aggfigure(**kwargs):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
 
-    kpos = 0
-    krv1 = 0
-    krv2 = 0
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if line.startswith('C'):
-            continue
-        fix = 0 if line.startswith('*') else 1
-        parts = line.split()
-        if not parts:
-            continue
-        if parts[0] == 'Object:':
-            orb.obj['name'] = ' '.join(parts[1:])
-        elif parts[0] == 'RA:':
-            orb.obj['radeg'] = 15 * getcoord(parts[1])
-        elif parts[0] == 'Dec:':
-            orb.obj['dedeg'] = getcoord(parts[1])
-        elif parts[0] == 'Parallax:':
-            orb.obj['parallax'] = float(parts[1])
-        elif parts[0] in orb.elname:
-            ind = orb.elname.index(parts[0])
-            orb.el[ind] = float(parts[1])
-            orb.fixel[ind] = fix
-        elif 'I1' in line and len(parts) >= 4:
-            orb.pos[kpos, 0:4] = [float(p) for p in parts[0:4]]
-            kpos += 1
-        elif 'Va' in line and len(parts) >= 3:
-            orb.rv1[krv1, 0:3] = [float(p) for p in parts[0:3]]
-            krv1 += 1
-        elif 'Vb' in line and len(parts) >= 3:
-            orb.rv2[krv2, 0:3] = [float(p) for p in parts[0:3]]
-            krv2 += 1
-
-    orb.pos = orb.pos[:kpos, :] if kpos > 0 else np.array([])
-    orb.rv1 = orb.rv1[:krv1, :] if krv1 > 0 else np.array([])
-    orb.rv2 = orb.rv2[:krv2, :] if krv2 > 0 else np.array([])
-
-    if kpos > 0:
-        correct(orb.pos, orb.el[1])
-    if krv1 > 0:
-        correct(orb.rv1, orb.el[1])
-    if krv2 > 0:
-        correct(orb.rv2, orb.el[1])
-
-    print(f"Position measures: {kpos}")
-    print(f"RV measures: {krv1}, {krv2}")
-    orb.obj['npos'] = kpos
-    orb.obj['nrv1'] = krv1
-    orb.obj['nrv2'] = krv2
-    orb.elerr = np.zeros(10)
-    orb.graph['mode'] = 1 if (krv1 > 0 or krv2 > 0) else 0
-    # HM:─── save the *initial* elements for later overlay & printing ───
-    orb.initial_el = orb.el.copy()
-    # Modifed by M.H. TALAFHA 20/05/2025
-    # If radial velocities are not included in the data file, you have to fix some paramters to ensure perfect fitting
-    # We have 10 parameters 'P', 'T', 'e', 'a', 'W', 'w', 'i', 'K1', 'K2', 'V0'
-    # if you want to fix the last 3 for example you should slice the array [7:10]
-    # if more needed to be fixed slice the array [5:10], this will fix the last 5 parameters
-    #if krv1 == 0 and krv2 == 0:
-    #  orb.fixel[7:10] = 0  # Fix K1, K2, V0
-    #  print("No RV data, fixing K1, K2, V0")
-
-# Orbit plotting
-def orbplot_streamlit():
-    import matplotlib.pyplot as plt
-    figs = []
-    name = orb.obj['fname'].split('.')[0]
+# Render a figure to bytes (png, pdf, svg, ...) and release its artists
+def figbytes(fig, fmt='png', dpi=100):
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi, bbox_inches='tight')
+    fig.clear()
+    return buf.getvalue()
+
+# Model values of one fit result, shared by the save, plot and residual
+# stages. Each value is computed on first use and kept: at the observation
+# epochs, the residuals, and the 100-point curves of the fitted and initial
+# orbits.
+# OrbitFit.model() hands out the bundle of the current elements and data.
+class ModelBundle:
+    ncurve = 100
+
+    def __init__(self, el, initial_el, pos, rv1, rv2, npos, nrv1, nrv2):
+        self.el = el.copy()
+        self.initial_el = initial_el.copy()
+        # Blocks without data are None
+        self.pos, self.rv1, self.rv2 = (a[:n] if n > 0 else None
+                                        for a, n in ((pos, npos), (rv1, nrv1), (rv2, nrv2)))
+        count('model_builds')
+
+    # Fitted [theta, rho] and [x, y] at the position epochs
+    @functools.cached_property
+    def pos_fit(self):
+        return eph(self.el, self.pos[:, 0], rho=True)
+
+    @functools.cached_property
+    def pos_xy(self):
+        return eph(self.el, self.pos[:, 0])
+
+    # Fitted velocities at the epochs of each RV component
+    @functools.cached_property
+    def rv1_fit(self):
+        return eph(self.el, self.rv1[:, 0], rv=True)[:, 0]
+
+    @functools.cached_property
+    def rv2_fit(self):
+        return eph(self.el, self.rv2[:, 0], rv=True)[:, 1]
+
+    # Observed minus fitted: [dtheta (wrapped to [-180, 180)), drho]
+    @functools.cached_property
+    def pos_resid(self):
+        d = self.pos[:, 1:3] - self.pos_fit
+        d[:, 0] = (d[:, 0] + 180) % 360 - 180
+        return d
+
+    @functools.cached_property
+    def rv1_resid(self):
+        return self.rv1[:, 1] - self.rv1_fit
+
+    @functools.cached_property
+    def rv2_resid(self):
+        return self.rv2[:, 1] - self.rv2_fit
+
+    # One revolution of the fitted and initial orbits: (t, [x, y])
+    @functools.cached_property
+    def orbit(self):
+        t = np.linspace(0, self.el[0], self.ncurve) + self.el[1]
+        return t, eph(self.el, t)
+
+    @functools.cached_property
+    def initial_orbit(self):
+        t = np.linspace(0, self.el[0], self.ncurve) + self.el[1]
+        return t, eph(self.initial_el, t)
+
+    # RV curve over the span of the RV data: (t, [V1, V2])
+    @functools.cached_property
+    def rv_curve(self):
+        t_all = np.concatenate([a[:, 0] for a in (self.rv1, self.rv2) if a is not None])
+        t = np.linspace(t_all.min(), t_all.max(), self.ncurve)
+        return t, eph(self.el, t, rv=True)
+
+    # RV curve over one period: (phase, [V1, V2])
+    @functools.cached_property
+    def rv_phase(self):
+        phases = np.linspace(0, 1, self.ncurve)
+        return phases, eph(self.el, phases * self.el[0] + self.el[1], rv=True)
+
+# Fit session: observations, elements and results of one orbit fit.
+# Sessions share no state, so several can run at once in one process.
+class OrbitFit(OrbitData):
+    obscache = os.path.join('temp_data', 'obs_cache')  # parsed-data cache, None disables
+
+    def __init__(self, out=None, progress=None):
+        super().__init__()
+        self.out = out  # log stream, None means sys.stdout
+        self.progress = progress  # progress(nfev, cost, el) during fitorb and mcmc
+        self.stats = RunStats()  # stage timings and counters, reset by every read
+        self.initial_el = self.el.copy()
+        self.modelcache = None  # (key, ModelBundle) of the last model() call
+
+    # Read input file
+    def readcsv_custom(self, fname):
+        self.stats = RunStats()
+        self.obj = {'name': '', 'radeg': 0.0, 'dedeg': 0.0, 'npos': 0, 'nrv1': 0, 'nrv2': 0, 'rms': np.zeros(4), 'chi2n': np.zeros(4), 'chi2': 0.0, 'fname': fname, 'parallax': 0.0}
+
+        self.loadfile(fname, 'csv')
+        # HM: ─── save the *initial* elements for later overlay & printing ───
+        self.initial_el = self.el.copy()
+
+    def readinp(self, fname):
+        self.stats = RunStats()
+        self.obj['fname'] = fname
+
+        if not os.path.exists(fname):
+            self.el = np.zeros(10)
+            self.fixel = np.ones(10, dtype=int)
+            print(f"File {fname} not found", file=self.out)
+            self.obj['fname'] = ''
+            return
 
-    gr = 180 / np.pi
+        self.loadfile(fname, 'inp')
+
+        print(f"Position measures: {self.obj['npos']}", file=self.out)
+        print(f"RV measures: {self.obj['nrv1']}, {self.obj['nrv2']}", file=self.out)
+        # HM:─── save the *initial* elements for later overlay & printing ───
+        self.initial_el = self.el.copy()
+        # Modifed by M.H. TALAFHA 20/05/2025
+        # If radial velocities are not included in the data file, you have to fix some paramters to ensure perfect fitting
+        # We have 10 parameters 'P', 'T', 'e', 'a', 'W', 'w', 'i', 'K1', 'K2', 'V0'
+        # if you want to fix the last 3 for example you should slice the array [7:10]
+        # if more needed to be fixed slice the array [5:10], this will fix the last 5 parameters
+        #if krv1 == 0 and krv2 == 0:
+        #  self.fixel[7:10] = 0  # Fix K1, K2, V0
+        #  print("No RV data, fixing K1, K2, V0")
+
+    # Parse fname with parseinp() or parsecsv() (kind 'inp' or 'csv') into
+    # the session and return the source labels (None for .inp). With
+    # obscache set, the parsed dataset is stored there on the first read and
+    # memory-mapped instead of parsed while the file content is unchanged.
+    # Errors and matrices of the previous fit are cleared with the elements.
+    @timed('parse')
+    def loadfile(self, fname, kind):
+        with open(fname, 'rb') as f:
+            raw = f.read()
+        self.elerr = np.zeros(10)
+        self.cov = np.zeros((10, 10))
+        self.corr = np.zeros((10, 10))
+        key = obskey(raw, kind) if self.obscache else None
+        cached = loadobs(self.obscache, key) if key else None
+        if cached is not None:
+            meta, self.el, self.fixel, obs, sources = cached
+            self.setobs(obs, convert=False, sources=sources)
+        else:
+            text = io.TextIOWrapper(io.BytesIO(raw)).read()  # decoded as open() would
+            if kind == 'csv':
+                meta, self.el, self.fixel, obs, sources = parsecsv(text, self.elname)
+            else:
+                meta, self.el, self.fixel, obs = parseinp(text, self.elname)
+                sources = None
+            self.setobs(obs, sources=sources)
+            if key:
+                try:
+                    saveobs(self.obscache, key, meta, self.el, self.fixel,
+                            {k: getattr(self, k) for k in OBSCOLS}, sources)
+                except OSError as e:
+                    print(f"Could not cache parsed data: {e}", file=self.out)
+        self.obj.update(meta)
+        return sources
+
+    # Install parsed observation arrays: counts, epochs converted to the
+    # units of T (unless convert=False), source labels and the plot mode.
+    # The labels of every reader replace those of an earlier read; rows
+    # without one (all of an .inp file) get ''.
+    def setobs(self, obs, convert=True, sources=None):
+        for key in ('pos', 'rv1', 'rv2'):
+            data = obs[key]
+            if convert and len(data) > 0:
+                correct(data, self.el[1])
+            setattr(self, key, data)
+            self.obj['n' + key] = len(data)
+            setattr(self, key + '_source', list(sources[key]) if sources else [''] * len(data))
+        self.graph['mode'] = 1 if (self.obj['nrv1'] > 0 or self.obj['nrv2'] > 0) else 0
+
+    # Warm start from a previous orbsave() output (either format): read
+    # the elements, errors and fix flags of its elements table.
+    def loadel(self, fname):
+        elements = readresult(fname)['elements']
+        if elements.empty:
+            raise ValueError(f"No orbital elements table in {fname}")
+        for name, val, err, fixed in elements[['Parameter', 'Value', 'Error', 'Fixed']].itertuples(index=False):
+            if name in self.elname:
+                ind = self.elname.index(name)
+                self.el[ind] = float(val)
+                self.elerr[ind] = float(err)
+                self.fixel[ind] = int(float(fixed))
+        print(f"Elements loaded from {fname}", file=self.out)
+
+    # Append new measurements to the session and, with refit=True, refit
+    # starting from the current elements. Rows are given as in the input
+    # files: pos as (t, theta, rho, err), rv1 and rv2 as (t, V, err); epochs
+    # are converted to the units of T like those read from the file.
+    def addobs(self, pos=None, rv1=None, rv2=None, source='', refit=True):
+        for key, new, ncol in (('pos', pos, 6), ('rv1', rv1, 3), ('rv2', rv2, 3)):
+            if new is None:
+                continue
+            new = np.atleast_2d(np.asarray(new, dtype=float))
+            if new.size == 0:
+                continue
+            rows = np.zeros((len(new), ncol))
+            rows[:, :new.shape[1]] = new
+            correct(rows, self.el[1])
+            old = getattr(self, key)
+            nold = self.obj['n' + key]
+            setattr(self, key, np.vstack([old[:nold], rows]) if nold > 0 else rows)
+            self.obj['n' + key] = nold + len(rows)
+            if hasattr(self, key + '_source'):
+                getattr(self, key + '_source').extend([source] * len(rows))
+        print(f"Observations now: npos={self.obj['npos']}, nrv1={self.obj['nrv1']}, nrv2={self.obj['nrv2']}",
+              file=self.out)
+        self.graph['mode'] = 1 if (self.obj['nrv1'] > 0 or self.obj['nrv2'] > 0) else 0
+        if refit:
+            return self.fitorb()
+
+    # Model values of the current elements, see ModelBundle. The bundle is
+    # kept until the elements, the initial elements or the data change.
+    def model(self):
+        key = (self.el.tobytes(), self.initial_el.tobytes(), id(self.pos), id(self.rv1),
+               id(self.rv2), self.obj['npos'], self.obj['nrv1'], self.obj['nrv2'])
+        if self.modelcache is None or self.modelcache[0] != key:
+            self.modelcache = (key, ModelBundle(self.el, self.initial_el, self.pos, self.rv1, self.rv2,
+                                                self.obj['npos'], self.obj['nrv1'], self.obj['nrv2']))
+        return self.modelcache[1]
+
+    # Orbit figures, built only on request: {'POS': visual orbit,
+    # 'RV_time': RV curve, 'RV_phase': phased RV curve} as far as there
+    # are data for them. They are plain Agg figures, unknown to pyplot, so
+    # they are freed with the last reference and never open a window.
+    @timed('plot')
+    def orbfigs(self):
+        figs = {}
+        model = self.model()
 
-    # --- Visual Orbit Plot ---
-    if orb.obj['npos'] > 0:
-        fig, ax = plt.subplots(figsize=(6, 6))
-        time = np.linspace(0, orb.el[0], 100) + orb.el[1]
-        xye = eph(orb.el, time)
-        xobs = -orb.pos[:, 2] * np.sin(orb.pos[:, 1] / gr)
-        yobs = orb.pos[:, 2] * np.cos(orb.pos[:, 1] / gr)
-        xy0 = eph(orb.el, orb.pos[:, 0])
-        
-        # HM:─── overlay the *initial* orbit in red dotted ───
-        xye_init = eph(orb.initial_el, time)
-        ax.plot(-xye_init[:, 1], xye_init[:, 0], 'r:', label='Initial Orbit')
-        # ─── now plot the fitted orbit ───
-
-        ax.plot(-xye[:, 1], xye[:, 0], 'k-', label='Orbit')
-        ax.plot(xobs, yobs, 'bs', label='Observations')
-        for i in range(len(xobs)):
-            ax.plot([xobs[i], -xy0[i, 1]], [yobs[i], xy0[i, 0]], 'k--')
-            year = int(round(orb.pos[i, 0]))
-            ax.text(xobs[i], yobs[i], str(year), fontsize=8)
-        ax.plot([0], [0], 'r*', markersize=10, label='Center')
-        ax.set_xlabel('X, arcsec (East)')
-        ax.set_ylabel('Y, arcsec (North)')
-        ax.set_title(f"Visual Orbit of {orb.obj['name']}")
-        ax.axis('equal')
-        ax.legend()
-        figs.append(fig)
-
-    # --- RV vs Time Plot ---
-    if orb.obj['nrv1'] > 0 or orb.obj['nrv2'] > 0:
-        t_all = np.concatenate([
-            orb.rv1[:, 0] if orb.obj['nrv1'] > 0 else [],
-            orb.rv2[:, 0] if orb.obj['nrv2'] > 0 else []
-        ])
-        t = np.linspace(min(t_all), max(t_all), 100)
-        rv = eph(orb.el, t, rv=True)
-
-        fig2, ax2 = plt.subplots(figsize=(8, 5))
-        if orb.obj['nrv1'] > 0:
-            ax2.errorbar(orb.rv1[:, 0], orb.rv1[:, 1], yerr=orb.rv1[:, 2], fmt='bo', label='Primary RV')
-            ax2.plot(t, rv[:, 0], 'b-', label='Primary Fit')
-        if orb.obj['nrv2'] > 0:
-            ax2.errorbar(orb.rv2[:, 0], orb.rv2[:, 1], yerr=orb.rv2[:, 2], fmt='ro', label='Secondary RV')
-            ax2.plot(t, rv[:, 1], 'r--', label='Secondary Fit')
-
-        ax2.set_xlabel('Time (JD)')
-        ax2.set_ylabel('Radial Velocity (km/s)')
-        ax2.set_title(f"RV Curve of {orb.obj['name']} vs Time")
-        ax2.legend()
-        figs.append(fig2)
-
-        # --- RV vs Phase Plot ---
-        fig3, ax3 = plt.subplots(figsize=(8, 5))
-        phases = np.linspace(0, 1, 100)
-        t_phase = phases * orb.el[0] + orb.el[1]
-        rv_phase = eph(orb.el, t_phase, rv=True)
-
-        if orb.obj['nrv1'] > 0:
-            phase1 = ((orb.rv1[:, 0] - orb.el[1]) / orb.el[0]) % 1
-            ax3.errorbar(phase1, orb.rv1[:, 1], yerr=orb.rv1[:, 2], fmt='bo', label='Primary RV')
-            ax3.plot(phases, rv_phase[:, 0], 'b-', label='Primary Fit')
-        if orb.obj['nrv2'] > 0:
-            phase2 = ((orb.rv2[:, 0] - orb.el[1]) / orb.el[0]) % 1
-            ax3.errorbar(phase2, orb.rv2[:, 1], yerr=orb.rv2[:, 2], fmt='ro', label='Secondary RV')
-            ax3.plot(phases, rv_phase[:, 1], 'r--', label='Secondary Fit')
-
-        ax3.set_xlabel('Phase')
-        ax3.set_ylabel('Radial Velocity (km/s)')
-        ax3.set_title(f"RV Curve of {orb.obj['name']} vs Phase")
-        ax3.legend()
-        figs.append(fig3)
-
-    return figs
+        gr = 180 / np.pi
 
-def residual_plots():
-    """
-    HM: (11/06/2025)
-    Residual Plots Δθ (°) and Δρ (arcsec) vs epoch, plus side boxplots.
-    Using the same pos[] array and fitted orbit in orb.el.
-    """
-    # get observation epochs and compute fitted values
-    t_obs   = orb.pos[:, 0]
-    res_obs = eph(orb.el, t_obs, rho=True)    # columns: [θ_fit, ρ_fit]
-    theta_fit, rho_fit = res_obs[:, 0], res_obs[:, 1]
-
-    # observed values
-    theta_obs = orb.pos[:, 1]    # PA in degrees
-    rho_obs   = orb.pos[:, 2]    # separation in arcsec
-
-    # residuals
-    dtheta = theta_obs - theta_fit
-    # wrap into [-180,180)
-    dtheta = (dtheta + 180) % 360 - 180
-
-    drho = rho_obs - rho_fit
-
-    # figure with 2 rows, 2 cols: left column is time series, right column boxplots
-    fig = plt.figure(figsize=(10, 6))
-    gs  = fig.add_gridspec(2, 2, width_ratios=[3,1], hspace=0.3, wspace=0.2)
-
-    # Δρ vs epoch
-    ax0 = fig.add_subplot(gs[0, 0])
-    ax0.axhline(0, color='k', linewidth=0.8)
-    ax0.scatter(t_obs, drho, marker='^', s=30)
-    ax0.set_ylabel(r'$\Delta\rho\,$(″)')
-    ax0.set_xticklabels([])   # no x‑labels on top panel
-
-    # Δθ vs epoch
-    ax1 = fig.add_subplot(gs[1, 0], sharex=ax0)
-    ax1.axhline(0, color='k', linewidth=0.8)
-    ax1.scatter(t_obs, dtheta, marker='*', s=30)
-    ax1.set_ylabel(r'$\Delta\theta\,$(°)')
-    ax1.xaxis.set_major_locator(MaxNLocator(nbins=6))
-    ax1.xaxis.set_major_formatter(lambda x, pos: f"{x:.0f}")
-    ax1.set_xlabel('Epoch (year)')
-
-    # boxplot of Δρ on right
-    ax2 = fig.add_subplot(gs[0, 1])
-    ax2.boxplot(drho, vert=True, widths=0.6)
-    ax2.set_xticks([])
-    ax2.set_title('ρ residuals')
-    ax2.set_ylim(ax0.get_ylim())
-
-    # boxplot of Δθ on right
-    ax3 = fig.add_subplot(gs[1, 1])
-    ax3.boxplot(dtheta, vert=True, widths=0.6)
-    ax3.set_xticks([])
-    ax3.set_title('θ residuals')
-    ax3.set_ylim(ax1.get_ylim())
+        # --- Visual Orbit Plot ---
+        if self.obj['npos'] > 0:
+            fig = aggfigure(figsize=(6, 6))
+            ax = fig.subplots()
+            xye = model.orbit[1]
+            xobs = -self.pos[:, 2] * np.sin(self.pos[:, 1] / gr)
+            yobs = self.pos[:, 2] * np.cos(self.pos[:, 1] / gr)
+            xy0 = model.pos_xy
+
+            # HM:─── overlay the *initial* orbit in red dotted ───
+            xye_init = model.initial_orbit[1]
+            ax.plot(-xye_init[:, 1], xye_init[:, 0], 'r:', label='Initial Orbit')
+            # ─── now plot the fitted orbit ───
+
+            ax.plot(-xye[:, 1], xye[:, 0], 'k-', label='Orbit')
+            ax.plot(xobs, yobs, 'bs', label='Observations')
+            for i in range(len(xobs)):
+                ax.plot([xobs[i], -xy0[i, 1]], [yobs[i], xy0[i, 0]], 'k--')
+                year = int(round(self.pos[i, 0]))
+                ax.text(xobs[i], yobs[i], str(year), fontsize=8)
+            ax.plot([0], [0], 'r*', markersize=10, label='Center')
+            ax.set_xlabel('X, arcsec (East)')
+            ax.set_ylabel('Y, arcsec (North)')
+            ax.set_title(f"Visual Orbit of {self.obj['name']}")
+            ax.axis('equal')
+            ax.legend()
+            figs['POS'] = fig
+
+        # --- RV vs Time Plot ---
+        if self.obj['nrv1'] > 0 or self.obj['nrv2'] > 0:
+            t, rv = model.rv_curve
+
+            fig2 = aggfigure(figsize=(8, 5))
+            ax2 = fig2.subplots()
+            if self.obj['nrv1'] > 0:
+                ax2.errorbar(self.rv1[:, 0], self.rv1[:, 1], yerr=self.rv1[:, 2], fmt='bo', label='Primary RV')
+                ax2.plot(t, rv[:, 0], 'b-', label='Primary Fit')
+            if self.obj['nrv2'] > 0:
+                ax2.errorbar(self.rv2[:, 0], self.rv2[:, 1], yerr=self.rv2[:, 2], fmt='ro', label='Secondary RV')
+                ax2.plot(t, rv[:, 1], 'r--', label='Secondary Fit')
+
+            ax2.set_xlabel('Time (JD)')
+            ax2.set_ylabel('Radial Velocity (km/s)')
+            ax2.set_title(f"RV Curve of {self.obj['name']} vs Time")
+            ax2.legend()
+            figs['RV_time'] = fig2
+
+            # --- RV vs Phase Plot ---
+            fig3 = aggfigure(figsize=(8, 5))
+            ax3 = fig3.subplots()
+            phases, rv_phase = model.rv_phase
+
+            if self.obj['nrv1'] > 0:
+                phase1 = ((self.rv1[:, 0] - self.el[1]) / self.el[0]) % 1
+                ax3.errorbar(phase1, self.rv1[:, 1], yerr=self.rv1[:, 2], fmt='bo', label='Primary RV')
+                ax3.plot(phases, rv_phase[:, 0], 'b-', label='Primary Fit')
+            if self.obj['nrv2'] > 0:
+                phase2 = ((self.rv2[:, 0] - self.el[1]) / self.el[0]) % 1
+                ax3.errorbar(phase2, self.rv2[:, 1], yerr=self.rv2[:, 2], fmt='ro', label='Secondary RV')
+                ax3.plot(phases, rv_phase[:, 1], 'r--', label='Secondary Fit')
+
+            ax3.set_xlabel('Phase')
+            ax3.set_ylabel('Radial Velocity (km/s)')
+            ax3.set_title(f"RV Curve of {self.obj['name']} vs Phase")
+            ax3.legend()
+            figs['RV_phase'] = fig3
+
+        return figs
+
+    def orbplot_streamlit(self):
+        return list(self.orbfigs().values())
+
+    @timed('plot')
+    def residual_plots(self):
+        """
+        HM: (11/06/2025)
+        Residual Plots Δθ (°) and Δρ (arcsec) vs epoch, plus side boxplots.
+        Using the same pos[] array and fitted orbit in self.el.
+        """
+        # observation epochs and residuals of the fitted orbit
+        # (Δθ wrapped into [-180,180)), shared with orbsave()
+        t_obs  = self.pos[:, 0]
+        dtheta, drho = self.model().pos_resid.T
+
+        # figure with 2 rows, 2 cols: left column is time series, right column boxplots
+        fig = aggfigure(figsize=(10, 6))
+        gs  = fig.add_gridspec(2, 2, width_ratios=[3,1], hspace=0.3, wspace=0.2)
+
+        # Δρ vs epoch
+        ax0 = fig.add_subplot(gs[0, 0])
+        ax0.axhline(0, color='k', linewidth=0.8)
+        ax0.scatter(t_obs, drho, marker='^', s=30)
+        ax0.set_ylabel(r'$\Delta\rho\,$(″)')
+        ax0.set_xticklabels([])   # no x‑labels on top panel
+
+        # Δθ vs epoch
+        ax1 = fig.add_subplot(gs[1, 0], sharex=ax0)
+        ax1.axhline(0, color='k', linewidth=0.8)
+        ax1.scatter(t_obs, dtheta, marker='*', s=30)
+        ax1.set_ylabel(r'$\Delta\theta\,$(°)')
+        from matplotlib.ticker import MaxNLocator
+        ax1.xaxis.set_major_locator(MaxNLocator(nbins=6))
+        ax1.xaxis.set_major_formatter(lambda x, pos: f"{x:.0f}")
+        ax1.set_xlabel('Epoch (year)')
+
+        # boxplot of Δρ on right
+        ax2 = fig.add_subplot(gs[0, 1])
+        ax2.boxplot(drho, vert=True, widths=0.6)
+        ax2.set_xticks([])
+        ax2.set_title('ρ residuals')
+        ax2.set_ylim(ax0.get_ylim())
+
+        # boxplot of Δθ on right
+        ax3 = fig.add_subplot(gs[1, 1])
+        ax3.boxplot(dtheta, vert=True, widths=0.6)
+        ax3.set_xticks([])
+        ax3.set_title('θ residuals')
+        ax3.set_ylim(ax1.get_ylim())
+
+        return fig
+
+
+    # With ps=True, save the plotbytes() figures as PNG files named after
+    # the input file and return their names; without, nothing is rendered
+    def orbplot(self, ps=False):
+        if not ps:
+            return []
+        name = os.path.splitext(self.obj['fname'])[0]
+        files = []
+        for key, png in self.plotbytes().items():
+            files.append(f"{name}_{key}.png")
+            with open(files[-1], 'wb') as f:
+                f.write(png)
+        return files
+
+    # Render the orbit figures (and the residual plot, key 'resid', when
+    # there are positions) to bytes in format fmt, releasing each figure
+    # once drawn. Batch jobs call this only if they want the plots.
+    @timed('render')
+    def plotbytes(self, fmt='png', dpi=100):
+        figs = self.orbfigs()
+        if self.obj['npos'] > 0:
+            figs['resid'] = self.residual_plots()
+        return {key: figbytes(fig, fmt, dpi) for key, fig in figs.items()}
+
+    # Fit orbital elements
+    def alleph(self, params, i):
+        selfit = np.where(self.fixel > 0)[0]
+        el0 = self.el.copy()
+        el0[selfit] = params
+
+        if i < 2 * self.obj['npos']:
+            j = 1 if i >= self.obj['npos'] else 0
+            time = self.pos[i - j * self.obj['npos'], 0]
+            res, der = ephder(el0, [time], rho=True)
+            return np.concatenate([[res[0, j]], der[0, j, selfit]])
+        elif i < 2 * self.obj['npos'] + self.obj['nrv1']:
+            time = self.rv1[i - 2 * self.obj['npos'], 0]
+            res, der = ephder(el0, [time], rv=True)
+            return np.concatenate([[res[0, 0]], der[0, 0, selfit]])
+        elif i < 2 * self.obj['npos'] + self.obj['nrv1'] + self.obj['nrv2']:
+            time = self.rv2[i - 2 * self.obj['npos'] - self.obj['nrv1'], 0]
+            res, der = ephder(el0, [time], rv=True)
+            return np.concatenate([[res[0, 1]], der[0, 1, selfit]])
+        return np.zeros(len(selfit) + 1)
+
+    # Blocks of the packed observation vector (theta, rho, RV1, RV2).
+    # Each entry is (epochs, eph flags, [(model column, slice), ...]) so that
+    # one model call serves every slice taken from the same epochs.
+    def obsblocks(self):
+        npos = self.obj['npos']
+        nrv1 = self.obj['nrv1']
+        nrv2 = self.obj['nrv2']
+        blocks = []
+        if npos > 0:
+            blocks.append((self.pos[:, 0], {'rho': True},
+                           [(0, slice(0, npos)), (1, slice(npos, 2*npos))]))
+        if nrv1 > 0:
+            blocks.append((self.rv1[:, 0], {'rv': True},
+                           [(0, slice(2*npos, 2*npos+nrv1))]))
+        if nrv2 > 0:
+            blocks.append((self.rv2[:, 0], {'rv': True},
+                           [(1, slice(2*npos+nrv1, 2*npos+nrv1+nrv2))]))
+        return blocks
+
+    # Packed observation vector (theta, rho, RV1, RV2) and its errors
+    def packobs(self):
+        npos = self.obj['npos']
+        nrv1 = self.obj['nrv1']
+        nrv2 = self.obj['nrv2']
+        n = 2 * npos + nrv1 + nrv2
+        yy = np.zeros(n)
+        err = np.zeros(n)
+
+        if npos > 0:
+            yy[:npos] = self.pos[:, 1]  # Position angles
+            err[:npos] = self.pos[:, 3] * 180 / np.pi / self.pos[:, 2]  # Angular error approximation
+            yy[npos:2*npos] = self.pos[:, 2]  # Separations
+            err[npos:2*npos] = self.pos[:, 3]  # Separation errors
+        if nrv1 > 0:
+            yy[2*npos:2*npos+nrv1] = self.rv1[:, 1]
+            err[2*npos:2*npos+nrv1] = self.rv1[:, 2]
+        if nrv2 > 0:
+            yy[2*npos+nrv1:] = self.rv2[:, 1]
+            err[2*npos+nrv1:] = self.rv2[:, 2]
+        return yy, err
+
+    # Seed P, T, e, w, K1, K2 and V0 from the RV data. A Lomb-Scargle
+    # periodogram over the whole frequency grid picks the npeak strongest
+    # peaks; the Keplerian periodogram (egrid) then searches around each
+    # peak and its half and double frequency. method='ls' keeps e = 0.
+    @timed('rvseed')
+    def rvseed(self, freq=None, method='kepler', npeak=5, egrid=(0.0, 0.2, 0.4, 0.6, 0.8),
+               nphase=8, apply=True):
+        nrv1 = self.obj['nrv1']
+        nrv2 = self.obj['nrv2']
+        if nrv1 == 0 and nrv2 == 0:
+            raise ValueError("No RV data to build a periodogram from")
+        parts = [rv for rv, nrv in ((self.rv1, nrv1), (self.rv2, nrv2)) if nrv > 0]
+        t = np.concatenate([rv[:, 0] for rv in parts])
+        y = np.concatenate([rv[:, 1] for rv in parts])
+        dy = np.concatenate([rv[:, 2] for rv in parts])
+        comp = np.repeat(np.arange(len(parts)), [len(rv) for rv in parts])
+        if freq is None:
+            freq = freqgrid(t)
+        span = t.max() - t.min()
+
+        power = lombscargle(t, y, dy, freq, comp)
+        peaks = np.flatnonzero((power[1:-1] > power[:-2]) & (power[1:-1] >= power[2:])) + 1
+        if not peaks.size:
+            peaks = np.array([np.argmax(power)])
+        peaks = peaks[np.argsort(power[peaks])[::-1][:npeak]]
+        cand = np.concatenate([freq[peaks] * h for h in (1, 0.5, 2)])
+        local = np.linspace(-2, 2, 41) / span
+        fine = np.unique(np.concatenate([fc + local for fc in cand]))
+        fine = fine[fine > 0]
+        if method == 'ls':
+            egrid = (0.0,)
+        kpower, ke, kph, kcoef = keplerogram(t, y, dy, fine, comp, egrid, nphase)
+
+        j = np.argmax(kpower)
+        f = fine[j]
+        P = 1 / f
+        T = kph[j] / (2 * np.pi * f)
+        T = t.min() + (T - t.min()) % P
+        coef = kcoef[j]
+        V0 = coef[0]
+        K1 = K2 = 0.0
+        if nrv1 > 0:
+            K1 = np.hypot(coef[1], coef[2])
+        if nrv2 > 0:
+            K2 = np.hypot(coef[-2], coef[-1])
+        # Primary amplitudes are K1 (cos w, sin w), secondary ones -K2 (cos w, sin w)
+        A = (coef[1] if nrv1 > 0 else 0) - (coef[-2] if nrv2 > 0 else 0)
+        B = (coef[2] if nrv1 > 0 else 0) - (coef[-1] if nrv2 > 0 else 0)
+        w = np.degrees(np.arctan2(B, A)) % 360
+        seed = {'P': P, 'T': T, 'e': ke[j], 'w': w, 'K1': K1, 'K2': K2, 'V0': V0,
+                'power': kpower[j], 'freq': freq, 'lspower': power}
+
+        print(f"RV periodogram ({len(freq)} frequencies, {method}): P={P:.5f} T={T:.4f} e={ke[j]:.2f} "
+              f"w={w:.1f} K1={K1:.3f} K2={K2:.3f} V0={V0:.3f} power={kpower[j]:.3f}", file=self.out)
+        if apply:
+            for name in ('P', 'T', 'e', 'w', 'K1', 'K2', 'V0'):
+                k = self.elname.index(name)
+                if self.fixel[k] > 0:
+                    self.el[k] = seed[name]
+        return seed
+
+    # Multi-start fit: LM runs from the input elements and from nstart - 1
+    # random starts in P, T, e, w and W (free elements only). Returns the
+    # distinct minima ranked by chi2 and leaves the session fitted at the best.
+    @timed('multistart')
+    def multistart(self, nstart=20, spread=0.1, seed=None, workers=None, xtol=1e-3):
+        yy, err = self.packobs()
+        blocks = self.obsblocks()
+        rng = np.random.default_rng(seed)
+        free = self.fixel > 0
+        starts = [self.el.copy()]
+        for k in range(1, nstart):
+            el = self.el.copy()
+            P = el[0] * np.exp(spread * rng.standard_normal()) if free[0] else el[0]
+            trial = [P, el[1] + P * rng.uniform(-0.5, 0.5), rng.uniform(0, 0.9),
+                     el[3], rng.uniform(0, 360), rng.uniform(0, 360)]
+            for j in (0, 1, 2, 4, 5):
+                if free[j]:
+                    el[j] = trial[j]
+            starts.append(el)
+        tasks = [(el, self.fixel, blocks, yy, err) for el in starts]
+
+        if workers == 1:
+            sols = [lmstart(task) for task in tasks]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                sols = list(pool.map(lmstart, tasks))
+        sols = [sol for sol in sols if sol is not None and sol[0][2] < 1]
+        if not sols:
+            raise RuntimeError("No start converged to a valid orbit")
+        rv = self.obj['nrv1'] > 0 or self.obj['nrv2'] > 0
+        minima = uniqsol(sols, self.el[1], xtol, rv)
+
+        print(f"Multi-start: {len(sols)}/{nstart} starts converged to {len(minima)} distinct minima", file=self.out)
+        for k, m in enumerate(minima[:10]):
+            vals = " ".join(f"{self.elname[j]}={m['el'][j]:.4f}" for j in np.where(free)[0])
+            print(f"  #{k + 1} chi2={m['chi2']:.4f} (x{m['count']}): {vals}", file=self.out)
+
+        self.el = minima[0]['raw'].copy()
+        self.fitorb()
+        return minima
+
+    # Resampling errors: nboot refits of bootstrap-resampled
+    # (method='bootstrap') or noise-perturbed (method='noise') observations,
+    # each warm-started from the current elements. A bootstrap replicate
+    # draws every measurement with replacement and weights it by its count,
+    # so theta and rho of one position stay together and the epochs do not
+    # change. The replicates get their own seeds spawned from `seed`, so the
+    # result does not depend on the number of workers.
+    @timed('resample')
+    def resample(self, nboot=200, method='bootstrap', seed=None, workers=None):
+        yy, err = self.packobs()
+        blocks = self.obsblocks()
+        npos = self.obj['npos']
+        nrv1 = self.obj['nrv1']
+        nrv2 = self.obj['nrv2']
+        n = len(yy)
+        if method not in ('bootstrap', 'noise'):
+            raise ValueError(f"Unknown resampling method {method!r}")
+
+        tasks = []
+        for ss in np.random.SeedSequence(seed).spawn(nboot):
+            rng = np.random.default_rng(ss)
+            if method == 'noise':
+                tasks.append((self.el, self.fixel, blocks, yy + err * rng.standard_normal(n), err))
+                continue
+            ndraw = np.zeros(n)
+            for start, num in ((0, npos), (2*npos, nrv1), (2*npos+nrv1, nrv2)):
+                if num > 0:
+                    ndraw[start:start+num] = np.bincount(rng.integers(num, size=num), minlength=num)
+            ndraw[npos:2*npos] = ndraw[:npos]
+            err1 = np.full(n, np.inf)  # measurements not drawn drop out
+            drawn = ndraw > 0
+            err1[drawn] = err[drawn] / np.sqrt(ndraw[drawn])
+            tasks.append((self.el, self.fixel, blocks, yy, err1))
+
+        if workers == 1:
+            sols = [lmstart(task) for task in tasks]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                nproc = workers or os.cpu_count() or 1
+                sols = list(pool.map(lmstart, tasks, chunksize=max(1, nboot // (4 * nproc))))
+        ok = [sol is not None and sol[0][2] < 1 for sol in sols]
+        if not any(ok):
+            raise RuntimeError("No resampled fit converged")
+        # Every replicate on the branch of the fitted solution, so equivalent
+        # (W + 180, w + 180, -K1, -K2) refits do not widen the spreads
+        rv = nrv1 > 0 or nrv2 > 0
+        els = np.array([foldto(sol[0], self.el, rv) for sol, good in zip(sols, ok) if good])
+        chi2 = np.array([sol[1] for sol, good in zip(sols, ok) if good])
+
+        masses = orbmasses(els, self.obj['parallax'])
+        selfit = np.where(self.fixel > 0)[0]
+        self.resample_result = {'method': method, 'el': els, 'chi2': chi2,
+                                'masses': masses, 'nfail': nboot - len(els),
+                                'err': els.std(axis=0, ddof=1) if len(els) > 1 else np.zeros(10)}
+
+        print(f"Resampling ({method}): {len(els)}/{nboot} refits converged", file=self.out)
+        pct = np.percentile(els, [16, 50, 84], axis=0)
+        for j in selfit:
+            print(f"{self.elname[j]:<5}: {pct[1, j]:>10.4f} ± {self.resample_result['err'][j]:.4f} "
+                  f"(68%: {pct[0, j]:.4f} .. {pct[2, j]:.4f})", file=self.out)
+        for k, name in enumerate(MASSNAMES):
+            m = masses[:, k]
+            if np.any(m != 0):
+                print(f"{name:<11}: {np.median(m):.4f} ± {np.std(m):.4f} Msun", file=self.out)
+        return self.resample_result
+
+    # Affine-invariant ensemble sampler (Goodman & Weare stretch move) over
+    # the free elements, started in a small ball around the current fit.
+    # Each half of the ensemble is moved at once, so one batched model
+    # evaluation serves all walkers of a half-step. Priors are flat, with
+    # P > 0, 0 <= e < 1 and a >= 0. The first `burn` steps (default
+    # nsteps // 4) are dropped from the samples and intervals. After every
+    # step, progress (if set) gets the best walker and its chi2 / 2.
+    @timed('mcmc')
+    def mcmc(self, nwalkers=32, nsteps=2000, burn=None, seed=None, a=2.0):
+        yy, err = self.packobs()
+        blocks = self.obsblocks()
+        n = len(yy)
+        npos = self.obj['npos']
+        selfit = np.where(self.fixel > 0)[0]
+        ndim = len(selfit)
+        if ndim == 0:
+            raise ValueError("No free elements to sample")
+        nwalkers = max(nwalkers, 2 * ndim + 2) // 2 * 2
+        if burn is None:
+            burn = nsteps // 4
+        rng = np.random.default_rng(seed)
+
+        def lnprob(par):
+            el = np.tile(self.el, (len(par), 1))
+            el[:, selfit] = par
+            ok = (el[:, 0] > 0) & (el[:, 2] >= 0) & (el[:, 2] < 1) & (el[:, 3] >= 0)
+            lp = np.full(len(par), -np.inf)
+            if ok.any():
+                d = yy - allmodel(el[ok], blocks, n)
+                d[:, :npos] = (d[:, :npos] + 180) % 360 - 180  # wrap position angles
+                lp[ok] = -0.5 * np.sum((d / err)**2, axis=1)
+            lp[~np.isfinite(lp)] = -np.inf
+            return lp
+
+        # Starting ball: a tenth of the LM errors, redrawn until valid
+        scale = self.elerr[selfit].copy()
+        zero = ~(scale > 0)  # also NaN for elements the fit did not determine
+        scale[zero] = 1e-4 * np.maximum(np.abs(self.el[selfit][zero]), 1)
+        pos = self.el[selfit] + 0.1 * scale * rng.standard_normal((nwalkers, ndim))
+        lp = lnprob(pos)
+        for it in range(100):
+            bad = ~np.isfinite(lp)
+            if not bad.any():
+                break
+            pos[bad] = self.el[selfit] + 0.1 * scale * rng.standard_normal((bad.sum(), ndim))
+            lp[bad] = lnprob(pos[bad])
+        if not np.all(np.isfinite(lp)):
+            raise ValueError("Could not place the walkers at valid starting elements")
+
+        chain = np.zeros((nsteps, nwalkers, ndim))
+        lnp = np.zeros((nsteps, nwalkers))
+        naccept = np.zeros(nwalkers)
+        half = nwalkers // 2
+        halves = (np.arange(half), np.arange(half, nwalkers))
+        for step in range(nsteps):
+            for k in (0, 1):
+                move, other = halves[k], halves[1 - k]
+                z = ((a - 1) * rng.random(half) + 1)**2 / a
+                partner = pos[other[rng.integers(half, size=half)]]
+                trial = partner + z[:, None] * (pos[move] - partner)
+                lp1 = lnprob(trial)
+                accept = np.log(rng.random(half)) < (ndim - 1) * np.log(z) + lp1 - lp[move]
+                idx = move[accept]
+                pos[idx] = trial[accept]
+                lp[idx] = lp1[accept]
+                naccept[idx] += 1
+            chain[step] = pos
+            lnp[step] = lp
+            if self.progress is not None:
+                best = np.argmax(lp)
+                el = self.el.copy()
+                el[selfit] = pos[best]
+                self.progress((step + 1) * nwalkers, -lp[best], el)
+
+        kept = chain[burn:]
+        samples = kept.reshape(-1, ndim)
+        names = [self.elname[j] for j in selfit]
+        tau = autocorr(kept)
+        rh = rhat(kept)
+        pct = np.percentile(samples, [2.5, 16, 50, 84, 97.5], axis=0)
+        intervals = {name: pct[:, j] for j, name in enumerate(names)}
+        self.mcmc_result = {'names': names, 'chain': chain, 'lnprob': lnp, 'burn': burn,
+                            'samples': samples, 'acceptance': naccept / nsteps,
+                            'tau': tau, 'rhat': rh, 'intervals': intervals}
+
+        print(f"MCMC: {nwalkers} walkers x {nsteps} steps, burn-in {burn}, "
+              f"mean acceptance {np.mean(naccept / nsteps):.3f}", file=self.out)
+        print(f"{'':<5}  {'median':>12} {'-1sig':>10} {'+1sig':>10} {'tau':>8} {'R-hat':>7}", file=self.out)
+        for j, name in enumerate(names):
+            p = intervals[name]
+            print(f"{name:<5}: {p[2]:>12.5f} {p[2] - p[1]:>10.5f} {p[3] - p[2]:>10.5f} "
+                  f"{tau[j]:>8.1f} {rh[j]:>7.3f}", file=self.out)
+        if np.any(len(kept) < 50 * tau) or np.any(rh > 1.1):
+            print("Warning: chain may not have converged (run longer than 50 tau, R-hat < 1.1)", file=self.out)
+        return self.mcmc_result
+
+    # Uncertainties of the derived masses: massdist() over element samples
+    # from source 'cov' (nsamples drawn from the fit covariance), 'mcmc'
+    # (the posterior samples of mcmc()) or 'resample' (the refits of
+    # resample()), with the parallax error parallax_err (mas).
+    @timed('masses')
+    def masserrors(self, source='cov', parallax_err=0.0, nsamples=100000, seed=None):
+        if source in ('mcmc', 'resample') and getattr(self, source + '_result', None) is None:
+            raise ValueError(f"No {source} samples, run {source}() first")
+        if source == 'cov':
+            # Elements the fit did not determine (NaN rows) are held at their values
+            unknown = np.isnan(np.diag(self.cov))
+            if unknown.any():
+                print("Held fixed, not determined by the fit: " +
+                      ", ".join(name for name, u in zip(self.elname, unknown) if u), file=self.out)
+            els, cov = self.el, np.where(unknown[:, None] | unknown[None, :], 0.0, self.cov)
+        elif source == 'mcmc':
+            res = self.mcmc_result
+            els = np.tile(self.el, (len(res['samples']), 1))
+            els[:, [self.elname.index(name) for name in res['names']]] = res['samples']
+            cov = None
+        elif source == 'resample':
+            els, cov = self.resample_result['el'], None
+        else:
+            raise ValueError(f"Unknown mass sample source {source!r}")
+        masses, summary = massdist(els, self.obj['parallax'], parallax_err, cov, nsamples, seed)
+        self.mass_result = {'source': source, 'masses': masses, 'summary': summary}
+
+        print(f"Mass distributions ({source}, {len(masses)} samples, "
+              f"parallax error {parallax_err:g} mas):", file=self.out)
+        for name in MASSNAMES:
+            m = summary[name]
+            if m['n'] == 0:
+                print(f"{name:<11}: not determined", file=self.out)
+            elif m['50%'] != 0:
+                print(f"{name:<11}: {m['50%']:.4f} -{m['50%'] - m['16%']:.4f} +{m['84%'] - m['50%']:.4f} Msun "
+                      f"(95%: {m['2.5%']:.4f} .. {m['97.5%']:.4f})", file=self.out)
+        return self.mass_result
+
+    @timed('fit')
+    def fitorb(self, rms_only=False):
+        npos = self.obj['npos']
+        nrv1 = self.obj['nrv1']
+        nrv2 = self.obj['nrv2']
+        n = 2 * npos + nrv1 + nrv2
+        yy, err = self.packobs()
+
+        selfit = np.where(self.fixel > 0)[0]
+        print(f"Fitting {len(selfit)} elements: {[self.elname[i] for i in selfit]}", file=self.out)
+        print(f"Total observations: {n} (npos={npos}, nrv1={nrv1}, nrv2={nrv2})", file=self.out)
+        par = self.el[selfit]
+        blocks = self.obsblocks()
+        if rms_only:
+            y1 = allmodel(self.el, blocks, n)
+            y1[:npos] = yy[:npos] - (yy[:npos] - y1[:npos] + 180) % 360 + 180  # wrapped like lmfit
+        else:
+            result = lmfit(self.el, self.fixel, blocks, yy, err, verbose=2 if self.out is None else 0,
+                           progress=self.progress)
+            print(f"LM stopped after {result.nfev} evaluations: {result.message}", file=self.out)
+            par = result.x
+            y1 = yy - result.fun * err
+            self.el[selfit] = par
+
+            n_params = len(selfit)
+            dof = n - n_params
+            print(f"Degrees of freedom: {dof}", file=self.out)
+            if dof > 0:
+                chi2 = np.sum(result.fun**2)
+                reduced_chi2 = chi2 / dof
+                print(f"Chi-squared: {chi2:.4f}, Reduced Chi-squared: {reduced_chi2:.4f}", file=self.out)
+                with stage('covariance'):
+                    # The solver's Jacobian at the solution, already weighted by 1/err
+                    J = result.jac
+                    print(f"Jacobian shape: {J.shape}", file=self.out)
+                    self.cov = np.zeros((10, 10))
+                    try:
+                        cov, cond, rank = covariance(J, reduced_chi2)
+                        print(f"JTJ condition number (scaled): {cond:.2e}", file=self.out)
+                        self.elerr[selfit] = np.sqrt(np.diag(cov))
+                        self.cov[np.ix_(selfit, selfit)] = cov
+                        if rank < len(selfit):
+                            print(f"Warning: Jacobian rank {rank} < {len(selfit)} free elements, "
+                                  "errors from the pseudo-inverse", file=self.out)
+                            unknown = [self.elname[k] for k in selfit if np.isnan(self.elerr[k])]
+                            print("Not determined by the data (error NaN): " + ", ".join(unknown),
+                                  file=self.out)
+                        else:
+                            print("Covariance matrix computed successfully", file=self.out)
+                    except np.linalg.LinAlgError as e:
+                        print(f"Error computing covariance: {e}", file=self.out)
+                        print("Using approximate errors", file=self.out)
+                        self.elerr[selfit] = np.abs(J.T @ result.fun) * np.sqrt(reduced_chi2) / n
+                    self.corr = correlation(self.cov)
+                    strong = [(self.elname[a], self.elname[b], self.corr[a, b])
+                              for k, a in enumerate(selfit) for b in selfit[k+1:]
+                              if abs(self.corr[a, b]) > 0.9]
+                    if strong:
+                        print("Strong correlations: " + ", ".join(f"{a}-{b} {r:+.3f}" for a, b, r in strong),
+                              file=self.out)
+            else:
+                print("Warning: Not enough degrees of freedom for error estimation", file=self.out)
+                self.elerr[selfit] = np.zeros(len(selfit))
+                self.cov = np.zeros((10, 10))
+                self.corr = np.zeros((10, 10))
+
+        wt = 1 / err**2
+        resid2 = (yy - y1)**2 * wt
+        nmin = [0, npos, 2*npos, 2*npos+nrv1]
+        nmax = [npos, 2*npos, 2*npos+nrv1, n]
+        ndat = [nmax[i] - nmin[i] for i in range(4)]
+        sd = [np.sum(resid2[nmin[j]:nmax[j]]) if ndat[j] > 0 else 0 for j in range(4)]
+        wsum = [np.sum(wt[nmin[j]:nmax[j]]) if ndat[j] > 0 else 0 for j in range(4)]
+        normchi2 = [sd[j] / ndat[j] if ndat[j] > 0 else 0 for j in range(4)]
+        wrms = [np.sqrt(sd[j] / wsum[j]) if wsum[j] > 0 else 0 for j in range(4)]
+
+        print("CHI2/N:", [f"{val:.4f}" for val in normchi2], file=self.out)
+        formatted = ", ".join(f"{val:.4f}" for val in wrms)
+        print(f"RMS (Theta, rho, RV1, RV2): {formatted}", file=self.out)
+        # HM:─── print the *initial* seven elements from the input file ───
+        print("\nInitial Parameters (from input file):", file=self.out)
+        for i in range(7):
+            nm = self.elname[i]
+            val = self.initial_el[i]
+            print(f"{nm:<5}: {val:>10.4f}", file=self.out)
+        # ─── now the fitted values and errors ───
+
+        print("\nFitted Parameters and Errors:", file=self.out)
+        for i, idx in enumerate(selfit):
+            print(f"{self.elname[idx]:<5}: {self.el[idx]:>10.4f} ± {self.elerr[idx]:.4f}", file=self.out)
+        self.obj['rms'] = wrms
+        self.obj['chi2n'] = normchi2
+        if not rms_only:
+            self.obj['chi2'] = np.sum((yy - y1)**2 / err**2)
+
+        return yy, y1
+
+    # Save results: the sectioned CSV (fmt='csv') or the same tables as
+    # columns of a NumPy archive (fmt='npz'), see readresult()
+    def orbsave(self, outfile=None, fmt='csv'):
+        if fmt not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format {fmt!r}")
+        if outfile is None:
+            name = self.obj['fname'].split('.')[0]
+            outfile = f"{name}_output.{fmt}"
+        self.saveresult(outfile, fmt)
+        self.savestats(outfile)
+
+    # Write the result tables of orbsave()
+    @timed('save')
+    def saveresult(self, outfile, fmt='csv'):
+        import pandas as pd
+        elements_data = {
+            'Parameter': self.elname,
+            'Value': self.el,
+            'Error': self.elerr,
+            'Fixed': self.fixel
+        }
+        elements_df = pd.DataFrame(elements_data)
+
+        if self.obj['npos'] > 0:
+            res = self.model().pos_fit
+            pos_data = {
+                'Time': self.pos[:, 0],
+                'PA_Obs': self.pos[:, 1],
+                'Rho_Obs': self.pos[:, 2],
+                'Err': self.pos[:, 3],
+                'PA_Fit': res[:, 0],
+                'Rho_Fit': res[:, 1]
+            }
+            pos_df = pd.DataFrame(pos_data)
+        else:
+            pos_df = pd.DataFrame()
+
+        if self.obj['nrv1'] > 0:
+            rv1_fit = self.model().rv1_fit
+            rv1_data = {
+                'Time': self.rv1[:, 0],
+                'RV_Obs': self.rv1[:, 1],
+                'Err': self.rv1[:, 2],
+                'RV_Fit': rv1_fit
+            }
+            rv1_df = pd.DataFrame(rv1_data)
+        else:
+            rv1_df = pd.DataFrame()
+
+        if self.obj['nrv2'] > 0:
+            rv2_fit = self.model().rv2_fit
+            rv2_data = {
+                'Time': self.rv2[:, 0],
+                'RV_Obs': self.rv2[:, 1],
+                'Err': self.rv2[:, 2],
+                'RV_Fit': rv2_fit
+            }
+            rv2_df = pd.DataFrame(rv2_data)
+        else:
+            rv2_df = pd.DataFrame()
+
+        total_mass = calculate_total_mass(self.el[0], self.el[3], self.obj['parallax'])
+        M12_sin3i, M1, M2 = calculate_spectroscopic_masses(self.el[0], self.el[2], self.el[6], self.el[7], self.el[8])
+
+        stats_data = {
+            'Metric': ['CHI2', 'CHI2/N_Theta', 'CHI2/N_Rho', 'CHI2/N_RV1', 'CHI2/N_RV2',
+                      'RMS_Theta', 'RMS_Rho', 'RMS_RV1', 'RMS_RV2', 'Parallax_mas',
+                      'Total_Mass_Msun', 'M(1+2)_sin3i', 'M1_Msun', 'M2_Msun'],
+            'Value': [self.obj['chi2'], self.obj['chi2n'][0], self.obj['chi2n'][1], self.obj['chi2n'][2],
+                     self.obj['chi2n'][3], self.obj['rms'][0], self.obj['rms'][1], self.obj['rms'][2],
+                     self.obj['rms'][3], self.obj['parallax'], total_mass, M12_sin3i, M1, M2]
+        }
+        stats_df = pd.DataFrame(stats_data)
+
+        # Covariance and correlation of the free elements, one row per element
+        free = [k for k in range(10) if self.fixel[k] > 0 and self.cov[k, k] > 0]
+        names = [self.elname[k] for k in free]
+        matrices = []
+        for mat in (self.cov, self.corr):
+            df = pd.DataFrame()
+            if free:
+                df = pd.DataFrame(mat[np.ix_(free, free)], columns=names)
+                df.insert(0, 'Parameter', names)
+            matrices.append(df)
+        cov_df, corr_df = matrices
+
+        tables = {'elements': elements_df, 'pos': pos_df, 'rv1': rv1_df, 'rv2': rv2_df, 'stats': stats_df,
+                  'covariance': cov_df, 'correlation': corr_df}
+        if fmt == 'npz':
+            # One array per table column, keyed "table/column"
+            arrays = {'meta/Object': np.array(self.obj['name']), 'meta/RA': np.array(self.obj['radeg'] / 15),
+                      'meta/Dec': np.array(self.obj['dedeg']), 'meta/Parallax': np.array(self.obj['parallax'])}
+            for key, df in tables.items():
+                for col in df.columns:
+                    numeric = pd.api.types.is_numeric_dtype(df[col])
+                    arrays[f"{key}/{col}"] = df[col].to_numpy() if numeric else df[col].to_numpy(dtype=str)
+            with open(outfile, 'wb') as f:
+                np.savez(f, **arrays)
+        else:
+            with open(outfile, 'w') as f:
+                f.write(f"# Object: {self.obj['name']}\n")
+                f.write(f"# RA: {self.obj['radeg']/15:.6f}\n")
+                f.write(f"# Dec: {self.obj['dedeg']:.6f}\n")
+                f.write(f"# Parallax (mas): {self.obj['parallax']:.6f}\n")
+                for key, df in tables.items():
+                    if key == 'elements' or key == 'stats' or not df.empty:
+                        f.write(f"\n# {RESULT_TABLES[key]}\n")
+                        df.to_csv(f, index=False)
+
+        print(f"Results saved to {outfile}", file=self.out)
+        #files.download(outfile)
+        if self.obj['parallax'] > 0:
+            print(f"Total system mass: {total_mass:.3f} solar masses", file=self.out)
+        else:
+            print("Parallax not provided, cannot calculate total mass", file=self.out)
+        print("\nSpectroscopic masses:", file=self.out)
+        print(f"M(1+2)*sin^3(i) = {M12_sin3i:.6f} solar masses", file=self.out)
+        print(f"M1 = {M1:.6f} solar masses", file=self.out)
+        print(f"M2 = {M2:.6f} solar masses", file=self.out)
+
+    # Print the run statistics (stage times and counters since the last
+    # read) and write them as JSON next to the result file outfile
+    def savestats(self, outfile):
+        stem = os.path.splitext(outfile)[0]
+        if stem.endswith('_output'):
+            stem = stem[:-len('_output')]
+        statsfile = f"{stem}_stats.json"
+        report = {'file': self.obj['fname'], 'object': self.obj['name'], 'npos': self.obj['npos'],
+                  'nrv1': self.obj['nrv1'], 'nrv2': self.obj['nrv2'], **self.stats.report()}
+        with open(statsfile, 'w') as f:
+            json.dump(report, f, indent=1)
+        print("\nRun statistics:", file=self.out)
+        for line in self.stats.lines():
+            print(line, file=self.out)
+        print(f"Run statistics saved to {statsfile}", file=self.out)
+        return report
+
+orb = OrbitFit()
+orb.obscache = None  # the module-level interface parses every file; set a directory to cache
+
+# Module-level interface, operating on the default session `orb`
+def readcsv_custom(fname):
+    return orb.readcsv_custom(fname)
 
-    return fig
+def readinp(fname):
+    return orb.readinp(fname)
+
+def loadel(fname):
+    return orb.loadel(fname)
 
+def addobs(pos=None, rv1=None, rv2=None, source='', refit=True):
+    return orb.addobs(pos, rv1, rv2, source, refit)
+
+def orbplot_streamlit():
+    return orb.orbplot_streamlit()
+
+def residual_plots():
+    return orb.residual_plots()
 
 def orbplot(ps=False):
-    global orb
-    name = orb.obj['fname'].split('.')[0]
+    return orb.orbplot(ps)
+
+def plotbytes(fmt='png', dpi=100):
+    return orb.plotbytes(fmt, dpi)
 
-    if orb.obj['npos'] > 0:
-        plt.figure(figsize=(6, 6))
-        time = np.linspace(0, orb.el[0], 100) + orb.el[1]
-        xye = eph(orb.el, time)
-        gr = 180 / np.pi
-        xobs = -orb.pos[:, 2] * np.sin(orb.pos[:, 1] / gr)
-        yobs = orb.pos[:, 2] * np.cos(orb.pos[:, 1] / gr)
-        xy0 = eph(orb.el, orb.pos[:, 0])
-        # HM:─── overlay the *initial* orbit in red dotted ───
-        xye_init = eph(orb.initial_el, time)
-        plt.plot(-xye_init[:, 1], xye_init[:, 0], 'r:', label='Initial Orbit')
-        # ─── now plot the fitted orbit ───
-
-        plt.plot(-xye[:, 1], xye[:, 0], 'k-', label='Orbit')
-        plt.plot(xobs, yobs, 'bs', label='Observations')
-        for i in range(len(xobs)):
-            plt.plot([xobs[i], -xy0[i, 1]], [yobs[i], xy0[i, 0]], 'k--')
-            year = int(round(orb.pos[i, 0]))
-            plt.text(xobs[i], yobs[i], str(year), fontsize=8)
-        plt.plot([0], [0], 'r*', markersize=10, label='Center')
-        plt.xlabel('X, arcsec (East)')
-        plt.ylabel('Y, arcsec (North)')
-        plt.title(f"Visual Orbit of {orb.obj['name']}")
-        plt.axis('equal')
-        plt.legend()
-        if ps:
-            plt.savefig(f"{name}_POS.png")
-            #files.download(f"{name}_POS.png")
-        #st.pyplot(plt.gcf())
-
-    if orb.obj['nrv1'] > 0 or orb.obj['nrv2'] > 0:
-        plt.figure(figsize=(8, 6))
-        t = np.linspace(min(np.concatenate([orb.rv1[:, 0] if orb.obj['nrv1'] > 0 else np.array([]),
-                                           orb.rv2[:, 0] if orb.obj['nrv2'] > 0 else np.array([])])),
-                       max(np.concatenate([orb.rv1[:, 0] if orb.obj['nrv1'] > 0 else np.array([]),
-                                           orb.rv2[:, 0] if orb.obj['nrv2'] > 0 else np.array([])])),
-                       100)
-        rv = eph(orb.el, t, rv=True)
-
-        if orb.obj['nrv1'] > 0:
-            plt.errorbar(orb.rv1[:, 0], orb.rv1[:, 1], yerr=orb.rv1[:, 2], fmt='bo', label='Primary RV')
-        if orb.obj['nrv2'] > 0:
-            plt.errorbar(orb.rv2[:, 0], orb.rv2[:, 1], yerr=orb.rv2[:, 2], fmt='ro', label='Secondary RV')
-
-        if orb.obj['nrv1'] > 0:
-            plt.plot(t, rv[:, 0], 'b-', label='Primary Fit')
-        if orb.obj['nrv2'] > 0:
-            plt.plot(t, rv[:, 1], 'r--', label='Secondary Fit')
-
-        plt.xlabel('Time (JD)')
-        plt.ylabel('Radial Velocity (km/s)')
-        plt.title(f"RV Curve of {orb.obj['name']} vs Time")
-        plt.legend()
-        if ps:
-            plt.savefig(f"{name}_RV_time.png")
-            #files.download(f"{name}_RV_time.png")
-        #st.pyplot(plt.gcf())
-
-        plt.figure(figsize=(8, 6))
-        t_phase = np.linspace(0, orb.el[0], 100) + orb.el[1]
-        rv = eph(orb.el, t_phase, rv=True)
-        phases = np.linspace(0, 1, 100)
-
-        if orb.obj['nrv1'] > 0:
-            phase1 = ((orb.rv1[:, 0] - orb.el[1]) / orb.el[0]) % 1
-            phase1[phase1 < 0] += 1
-            plt.errorbar(phase1, orb.rv1[:, 1], yerr=orb.rv1[:, 2], fmt='bo', label='Primary RV')
-        if orb.obj['nrv2'] > 0:
-            phase2 = ((orb.rv2[:, 0] - orb.el[1]) / orb.el[0]) % 1
-            phase2[phase2 < 0] += 1
-            plt.errorbar(phase2, orb.rv2[:, 1], yerr=orb.rv2[:, 2], fmt='ro', label='Secondary RV')
-
-        if orb.obj['nrv1'] > 0:
-            plt.plot(phases, rv[:, 0], 'b-', label='Primary Fit')
-        if orb.obj['nrv2'] > 0:
-            plt.plot(phases, rv[:, 1], 'r--', label='Secondary Fit')
-
-        plt.xlabel('Phase')
-        plt.ylabel('Radial Velocity (km/s)')
-        plt.title(f"RV Curve of {orb.obj['name']} vs Phase")
-        plt.legend()
-        if ps:
-            plt.savefig(f"{name}_RV_phase.png")
-            #files.download(f"{name}_RV_phase.png")
-        #st.pyplot(plt.gcf())
-
-# Fit orbital elements
 def alleph(params, i):
-    global orb
-    selfit = np.where(orb.fixel > 0)[0]
-    el0 = orb.el.copy()
-    el0[selfit] = params
-    e = 0.01
-    del_vals = [e * el0[0], e * el0[0], e, e * el0[3], 1, 1, 1, e * el0[7], e * el0[8], e * el0[7]]
-
-    if i < 2 * orb.obj['npos']:
-        j = 1 if i >= orb.obj['npos'] else 0
-        time = orb.pos[i - j * orb.obj['npos'], 0]
-        res = eph(el0, [time], rho=True)[0, j]
-        deriv = np.zeros(10)
-        for k in range(10):
-            if orb.fixel[k] > 0:
-                el1 = el0.copy()
-                el1[k] += del_vals[k]
-                deriv[k] = (eph(el1, [time], rho=True)[0, j] - res) / del_vals[k]
-        return np.concatenate([[res], deriv[selfit]])
-    elif i < 2 * orb.obj['npos'] + orb.obj['nrv1']:
-        time = orb.rv1[i - 2 * orb.obj['npos'], 0]
-        res = eph(el0, [time], rv=True)[0, 0]
-        deriv = np.zeros(10)
-        for k in range(10):
-            if orb.fixel[k] > 0:
-                el1 = el0.copy()
-                el1[k] += del_vals[k]
-                deriv[k] = (eph(el1, [time], rv=True)[0, 0] - res) / del_vals[k]
-        return np.concatenate([[res], deriv[selfit]])
-    elif i < 2 * orb.obj['npos'] + orb.obj['nrv1'] + orb.obj['nrv2']:
-        time = orb.rv2[i - 2 * orb.obj['npos'] - orb.obj['nrv1'], 0]
-        res = eph(el0, [time], rv=True)[0, 1]
-        deriv = np.zeros(10)
-        for k in range(10):
-            if orb.fixel[k] > 0:
-                el1 = el0.copy()
-                el1[k] += del_vals[k]
-                deriv[k] = (eph(el1, [time], rv=True)[0, 1] - res) / del_vals[k]
-        return np.concatenate([[res], deriv[selfit]])
-    return np.zeros(len(selfit) + 1)
+    return orb.alleph(params, i)
+
+def obsblocks():
+    return orb.obsblocks()
 
 def fitorb(rms_only=False):
-    global orb
-    npos = orb.obj['npos']
-    nrv1 = orb.obj['nrv1']
-    nrv2 = orb.obj['nrv2']
-    n = 2 * npos + nrv1 + nrv2
-    yy = np.zeros(n)
-    err = np.zeros(n)
-
-    if npos > 0:
-        yy[:npos] = orb.pos[:, 1]  # Position angles
-        err[:npos] = orb.pos[:, 3] * 180 / np.pi / orb.pos[:, 2]  # Angular error approximation
-        yy[npos:2*npos] = orb.pos[:, 2]  # Separations
-        err[npos:2*npos] = orb.pos[:, 3]  # Separation errors
-    if nrv1 > 0:
-        yy[2*npos:2*npos+nrv1] = orb.rv1[:, 1]
-        err[2*npos:2*npos+nrv1] = orb.rv1[:, 2]
-    if nrv2 > 0:
-        yy[2*npos+nrv1:] = orb.rv2[:, 1]
-        err[2*npos+nrv1:] = orb.rv2[:, 2]
-
-    selfit = np.where(orb.fixel > 0)[0]
-    print(f"Fitting {len(selfit)} elements: {[orb.elname[i] for i in selfit]}")
-    print(f"Total observations: {n} (npos={npos}, nrv1={nrv1}, nrv2={nrv2})")
-    par = orb.el[selfit]
-    def residuals(params):
-      y1 = np.array([alleph(params, i)[0] for i in range(n)])
-      return (yy - y1) / err
-    if rms_only:
-        y1 = np.array([alleph(par, i)[0] for i in range(n)])
-    else:
-        result = least_squares(residuals, par, method='lm', max_nfev=1000, ftol=1e-10, xtol=1e-10, verbose=2)
-        par = result.x
-        y1 = yy - result.fun * err
-        orb.el[selfit] = par
-
-        n_params = len(selfit)
-        dof = n - n_params
-        print(f"Degrees of freedom: {dof}")
-        if dof > 0:
-            chi2 = np.sum(result.fun**2)
-            reduced_chi2 = chi2 / dof
-            print(f"Chi-squared: {chi2:.4f}, Reduced Chi-squared: {reduced_chi2:.4f}")
-
-            J = np.array([alleph(par, i)[1:] for i in range(n)])
-            print(f"Jacobian shape: {J.shape}")
+    return orb.fitorb(rms_only)
 
-            try:
-                JTJ = J.T @ J
-                print(f"JTJ condition number: {np.linalg.cond(JTJ):.2e}")
-                cov = np.linalg.inv(JTJ) * reduced_chi2
-                errors = np.sqrt(np.diag(cov))
-                orb.elerr[selfit] = errors
-                print("Covariance matrix computed successfully")
-            except np.linalg.LinAlgError as e:
-                print(f"Error computing covariance: {e}")
-                print("Using approximate errors")
-                orb.elerr[selfit] = np.abs(J.T @ result.fun) * np.sqrt(reduced_chi2) / n
-        else:
-            print("Warning: Not enough degrees of freedom for error estimation")
-            orb.elerr[selfit] = np.zeros(len(selfit))
-
-    wt = 1 / err**2
-    resid2 = (yy - y1)**2 * wt
-    nmin = [0, npos, 2*npos, 2*npos+nrv1]
-    nmax = [npos, 2*npos, 2*npos+nrv1, n]
-    ndat = [nmax[i] - nmin[i] for i in range(4)]
-    sd = [np.sum(resid2[nmin[j]:nmax[j]]) if ndat[j] > 0 else 0 for j in range(4)]
-    wsum = [np.sum(wt[nmin[j]:nmax[j]]) if ndat[j] > 0 else 0 for j in range(4)]
-    normchi2 = [sd[j] / ndat[j] if ndat[j] > 0 else 0 for j in range(4)]
-    wrms = [np.sqrt(sd[j] / wsum[j]) if wsum[j] > 0 else 0 for j in range(4)]
-
-    print("CHI2/N:", [f"{val:.4f}" for val in normchi2])
-    formatted = ", ".join(f"{val:.4f}" for val in wrms)
-    print(f"RMS (Theta, rho, RV1, RV2): {formatted}")
-    # HM:─── print the *initial* seven elements from the input file ───
-    print("\nInitial Parameters (from input file):")
-    for i in range(7):
-        nm = orb.elname[i]
-        val = orb.initial_el[i]
-        print(f"{nm:<5}: {val:>10.4f}")
-    # ─── now the fitted values and errors ───
-
-    print("\nFitted Parameters and Errors:")
-    for i, idx in enumerate(selfit):
-        print(f"{orb.elname[idx]:<5}: {orb.el[idx]:>10.4f} ± {orb.elerr[idx]:.4f}")
-
-    orb.obj['rms'] = wrms
-    orb.obj['chi2n'] = normchi2
-    if not rms_only:
-        orb.obj['chi2'] = np.sum((yy - y1)**2 / err**2)
-        orbplot()
-
-    return yy, y1
-
-# Calculate total mass
-def calculate_total_mass(P, a, parallax):
-    if parallax <= 0:
-        return 0.0
-    distance_pc = 1000.0 / parallax
-    a_au = a * distance_pc
-    total_mass = (a_au**3) / (P**2)
-    return total_mass
-
-# Calculate spectroscopic masses
-def calculate_spectroscopic_masses(P, e, i, K1, K2):
-    if K1 == 0 and K2 == 0:
-        return 0.0, 0.0, 0.0
+def rvseed(freq=None, method='kepler', npeak=5, egrid=(0.0, 0.2, 0.4, 0.6, 0.8), nphase=8, apply=True):
+    return orb.rvseed(freq, method, npeak, egrid, nphase, apply)
 
-    i_rad = np.radians(i)
-    sin_i = np.sin(i_rad)
-    sin3_i = sin_i**3
-    K_sum = K1 + K2
+def multistart(nstart=20, spread=0.1, seed=None, workers=None, xtol=1e-3):
+    return orb.multistart(nstart, spread, seed, workers, xtol)
 
-    # M(1+2) * sin^3(i) in solar masses
-    M12_sin3i = (K_sum**3 * P * (1 - e**2)**(3/2)) / (2 * np.pi * G)
+def resample(nboot=200, method='bootstrap', seed=None, workers=None):
+    return orb.resample(nboot, method, seed, workers)
 
-    q = K1 / K2 if K2 != 0 else float('inf')
-    if q != float('inf'):
-        M_total = M12_sin3i / sin3_i
-        M1 = M_total / (1 + q)
-        M2 = q * M1
-    else:
-        M1 = M12_sin3i / sin3_i
-        M2 = 0.0
-
-    return M12_sin3i, M1, M2
-
-# Save results
-def orbsave():
-    global orb
-    name = orb.obj['fname'].split('.')[0]
-    outfile = f"{name}_output.csv"
-
-    elements_data = {
-        'Parameter': orb.elname,
-        'Value': orb.el,
-        'Error': orb.elerr,
-        'Fixed': orb.fixel
-    }
-    elements_df = pd.DataFrame(elements_data)
-
-    if orb.obj['npos'] > 0:
-        res = eph(orb.el, orb.pos[:, 0], rho=True)
-        pos_data = {
-            'Time': orb.pos[:, 0],
-            'PA_Obs': orb.pos[:, 1],
-            'Rho_Obs': orb.pos[:, 2],
-            'Err': orb.pos[:, 3],
-            'PA_Fit': res[:, 0],
-            'Rho_Fit': res[:, 1]
-        }
-        pos_df = pd.DataFrame(pos_data)
-    else:
-        pos_df = pd.DataFrame()
-
-    if orb.obj['nrv1'] > 0:
-        rv1_fit = eph(orb.el, orb.rv1[:, 0], rv=True)[:, 0]
-        rv1_data = {
-            'Time': orb.rv1[:, 0],
-            'RV_Obs': orb.rv1[:, 1],
-            'Err': orb.rv1[:, 2],
-            'RV_Fit': rv1_fit
-        }
-        rv1_df = pd.DataFrame(rv1_data)
-    else:
-        rv1_df = pd.DataFrame()
-
-    if orb.obj['nrv2'] > 0:
-        rv2_fit = eph(orb.el, orb.rv2[:, 0], rv=True)[:, 1]
-        rv2_data = {
-            'Time': orb.rv2[:, 0],
-            'RV_Obs': orb.rv2[:, 1],
-            'Err': orb.rv2[:, 2],
-            'RV_Fit': rv2_fit
-        }
-        rv2_df = pd.DataFrame(rv2_data)
-    else:
-        rv2_df = pd.DataFrame()
-
-    total_mass = calculate_total_mass(orb.el[0], orb.el[3], orb.obj['parallax'])
-    M12_sin3i, M1, M2 = calculate_spectroscopic_masses(orb.el[0], orb.el[2], orb.el[6], orb.el[7], orb.el[8])
-
-    stats_data = {
-        'Metric': ['CHI2', 'CHI2/N_Theta', 'CHI2/N_Rho', 'CHI2/N_RV1', 'CHI2/N_RV2',
-                  'RMS_Theta', 'RMS_Rho', 'RMS_RV1', 'RMS_RV2', 'Parallax_mas',
-                  'Total_Mass_Msun', 'M(1+2)_sin3i', 'M1_Msun', 'M2_Msun'],
-        'Value': [orb.obj['chi2'], orb.obj['chi2n'][0], orb.obj['chi2n'][1], orb.obj['chi2n'][2],
-                 orb.obj['chi2n'][3], orb.obj['rms'][0], orb.obj['rms'][1], orb.obj['rms'][2],
-                 orb.obj['rms'][3], orb.obj['parallax'], total_mass, M12_sin3i, M1, M2]
-    }
-    stats_df = pd.DataFrame(stats_data)
-
-    with open(outfile, 'w') as f:
-        f.write(f"# Object: {orb.obj['name']}\n")
-        f.write(f"# RA: {orb.obj['radeg']/15:.6f}\n")
-        f.write(f"# Dec: {orb.obj['dedeg']:.6f}\n")
-        f.write(f"# Parallax (mas): {orb.obj['parallax']:.6f}\n")
-        f.write("\n# Orbital Elements\n")
-        elements_df.to_csv(f, index=False)
-        if not pos_df.empty:
-            f.write("\n# Position Measurements\n")
-            pos_df.to_csv(f, index=False)
-        if not rv1_df.empty:
-            f.write("\n# Primary RV Measurements\n")
-            rv1_df.to_csv(f, index=False)
-        if not rv2_df.empty:
-            f.write("\n# Secondary RV Measurements\n")
-            rv2_df.to_csv(f, index=False)
-        f.write("\n# Statistics\n")
-        stats_df.to_csv(f, index=False)
-
-    print(f"Results saved to {outfile}")
-    #files.download(outfile)
-    if orb.obj['parallax'] > 0:
-        print(f"Total system mass: {total_mass:.3f} solar masses")
-    else:
-        print("Parallax not provided, cannot calculate total mass")
+def mcmc(nwalkers=32, nsteps=2000, burn=None, seed=None, a=2.0):
+    return orb.mcmc(nwalkers, nsteps, burn, seed, a)
+
+def masserrors(source='cov', parallax_err=0.0, nsamples=100000, seed=None):
+    return orb.masserrors(source, parallax_err, nsamples, seed)
+
+def orbsave(outfile=None, fmt='csv'):
+    return orb.orbsave(outfile, fmt)
 
-    print("\nSpectroscopic masses:")
-    print(f"M(1+2)*sin^3(i) = {M12_sin3i:.6f} solar masses")
-    print(f"M1 = {M1:.6f} solar masses")
-    print(f"M2 = {M2:.6f} solar masses")
+def savestats(outfile):
+    return orb.savestats(outfile)
 
 # --- Local GUI Interface using Tkinter ---
 
@@ -971,7 +2452,7 @@ def run_fit():
             xobs = -orb.pos[:, 2] * np.sin(orb.pos[:, 1] / gr)
             yobs = orb.pos[:, 2] * np.cos(orb.pos[:, 1] / gr)
             ax.plot(xobs, yobs, 'bo', label='Observed')
-            xye = eph(orb.el, np.linspace(0, orb.el[0], 200) + orb.el[1])
+            xye = orb.model().orbit[1]
             ax.plot(-xye[:, 1], xye[:, 0], 'r-', label='Fitted Orbit')
             ax.plot(0, 0, 'k*', markersize=10, label='Center')
             ax.set_title(f"Visual Orbit of {orb.obj['name']}")
@@ -3,14 +3,15 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import io
-import sys
 import os
+import tempfile
 
-from rv_orbital_fitting_with_advanced_gui import readinp, readcsv_custom, fitorb, orbsave, orbplot_streamlit, orb, residual_plots
+from rv_orbital_fitting_with_advanced_gui import OrbitFit, ELNAME, solversettings
+from fit_cache import FitCache, fitkey
+from fit_jobs import JobQueue
 
-# --- Redirect stdout to display logs ---
+# --- Collect the fit log for display ---
 class StreamlitRedirect(io.StringIO):
     def __init__(self):
         super().__init__()
@@ -62,54 +63,150 @@ else:
 
 fix_params = st.multiselect(
     "Select parameters to **fix during fitting**:",
-    ['P', 'T', 'e', 'a', 'W', 'w', 'i', 'K1', 'K2', 'V0'],
+    ELNAME,
     default=['K1', 'K2', 'V0']
 )
 
+rv_seed = st.checkbox("Seed P, T, e, ω, K1, K2 and V0 from an RV periodogram before fitting")
+
+run_mcmc = st.checkbox("Sample the posterior with MCMC after the fit (credible intervals)")
+mcmc_steps = st.number_input("MCMC steps", min_value=200, max_value=20000, value=1000, step=100,
+                             disabled=not run_mcmc)
+
 run = st.button("Run Orbital Fit")
 
+
+# --- Background fits: one worker pool shared by all browser sessions ---
+@st.cache_resource
+def jobqueue():
+    return JobQueue(workers=2)
+
+
+# --- Fit once and keep everything the page shows, so a cache can replay it ---
+# Runs in a worker thread: no st.* calls in here.
+def fit_entry(job, name, data, fixel, settings):
+    # Each run gets its own fit session, log and scratch directory for the
+    # input and the orbsave() files, so concurrent browser sessions share
+    # no data, even for inputs of the same name. The cache key is taken
+    # from the same bytes that are fitted, so an entry is never stored
+    # under another input's key.
+    key = fitkey(data, os.path.splitext(name)[1], fixel, **settings)
+    with tempfile.TemporaryDirectory(prefix='orbitfit_') as jobdir:
+        path = os.path.join(jobdir, os.path.basename(name))
+        with open(path, "wb") as f:
+            f.write(data)
+        return fit_job(job, path, fixel, settings, key)
+
+
+# The fit itself, on the job's own copy of the input at path
+def fit_job(job, path, fixel, settings, key):
+    buffer = StreamlitRedirect()
+    job.log = buffer
+    fit = OrbitFit(out=buffer, progress=job.report)
+    if path.endswith(".csv"):
+        fit.readcsv_custom(path)
+    else:
+        fit.readinp(path)
+    fit.fixel = fixel.copy()
+    if settings['rvseed']:
+        if fit.obj['nrv1'] > 0 or fit.obj['nrv2'] > 0:
+            fit.rvseed()
+        else:
+            print("No RV data: skipping the RV periodogram seed", file=buffer)
+    fit.fitorb()
+    mcmc_table = None
+    if settings['mcmc_steps']:
+        fit.mcmc(nsteps=settings['mcmc_steps'])
+        res = fit.mcmc_result
+        mcmc_table = pd.DataFrame(
+            [dict(zip(['2.5%', '16%', '50%', '84%', '97.5%'], res['intervals'][name]),
+                  tau=res['tau'][j], R_hat=res['rhat'][j])
+             for j, name in enumerate(res['names'])],
+            index=res['names'])
+    # Figures are rendered to PNG once and released right away
+    pngs = fit.plotbytes()
+    # Saved last, so the run statistics in the log cover every stage
+    outfile = f"{os.path.splitext(path)[0]}_output.csv"
+    fit.orbsave(outfile=outfile)
+    with open(outfile) as f:
+        output = f.read()
+    entry = {'log': buffer.output, 'el': fit.el.copy(), 'elerr': fit.elerr.copy(),
+             'fixel': fit.fixel.copy(), 'obj': dict(fit.obj), 'mcmc': mcmc_table,
+             'outfile': os.path.basename(outfile), 'output': output,
+             #HM: (11/06/2025) Added Residual Plots
+             'resid': pngs.pop('resid', None), 'figs': list(pngs.values())}
+    FitCache().put(key, entry)
+    return entry
+
+
+def show_entry(entry):
+    st.subheader("Process Output Log")
+    st.text(entry['log'])
+    if entry['mcmc'] is not None:
+        st.subheader("MCMC Credible Intervals")
+        st.dataframe(entry['mcmc'])
+    st.subheader("Visual Orbit")
+    for png in entry['figs']:
+        st.image(png)
+    if entry['resid'] is not None:
+        st.subheader("Residuals (Observed − Fitted)")
+        st.image(entry['resid'])
+    st.download_button("Download the fit results (CSV)", entry['output'],
+                       file_name=entry['outfile'], mime="text/csv")
+
+
+# --- Live progress of a running job; reruns the whole page once it ends ---
+@st.fragment(run_every=1.0)
+def job_progress(job_id):
+    job = jobqueue().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    if job.status == 'queued':
+        st.info(f"Fit of {job.label} queued (job {job.id}, {jobqueue().ahead(job)} ahead)")
+    else:
+        cost = "" if job.cost is None else f", chi2 = {2 * job.cost:.4f}"
+        st.info(f"Fitting {job.label} (job {job.id}): {job.nfev} model evaluations{cost}")
+        if job.el is not None:
+            st.dataframe(pd.DataFrame([job.el], columns=ELNAME), hide_index=True)
+        if job.log is not None:
+            st.text("\n".join(job.log.output.splitlines()[-15:]))
+    if st.button("Cancel fit", key=f"cancel_{job.id}"):
+        job.cancel()
+
+
 if (uploaded_file or selected_example) and run:
-        with st.spinner("Running orbital fitting..."):
-            os.makedirs("temp_data", exist_ok=True)
-            # Decide file source
-            if uploaded_file:
-                path = os.path.join("temp_data", uploaded_file.name)
-                with open(path, "wb") as f:
-                    f.write(uploaded_file.read())
-            elif selected_example:
-                # Set absolute path for local example
-                source_path = os.path.join("input_data", selected_example)
-                path = os.path.join("temp_data", selected_example)
-                os.makedirs("temp_data", exist_ok=True)
-                with open(source_path, "rb") as src, open(path, "wb") as dst:
-                    dst.write(src.read())
-            buffer = StreamlitRedirect()
-            sys.stdout = buffer
-            sys.stderr = buffer
-            try:
-                if path.endswith(".csv"):
-                    readcsv_custom(path)
-                else:
-                    readinp(path)
-                orb.fixel = np.ones(10, dtype=int)
-                for i, name in enumerate(orb.elname):
-                    if name in fix_params:
-                        orb.fixel[i] = 0
-                fitorb()
-                orbsave()
-                st.subheader("Process Output Log")
-                st.text(buffer.output)
-                st.subheader("Visual Orbit")
-                figs = orbplot_streamlit()
-                for fig in figs:
-                    st.pyplot(fig)
-                #HM: (11/06/2025) Added Residual Plots
-                st.subheader("Residuals (Observed − Fitted)")
-                fig_resid = residual_plots()
-                st.pyplot(fig_resid)
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
-            finally:
-                sys.stdout = sys.__stdout__
-                sys.stderr = sys.__stderr__
+        # Decide file source
+        if uploaded_file:
+            name = uploaded_file.name
+            data = uploaded_file.getvalue()
+        elif selected_example:
+            name = selected_example
+            with open(os.path.join("input_data", selected_example), "rb") as src:
+                data = src.read()
+        fixel = np.array([0 if p in fix_params else 1 for p in ELNAME])
+        settings = {'rvseed': rv_seed, 'mcmc_steps': int(mcmc_steps) if run_mcmc else 0,
+                    'solver': solversettings()}
+        key = fitkey(data, os.path.splitext(name)[1], fixel, **settings)
+        st.session_state['entry'] = FitCache().get(key)
+        st.session_state['job'] = None
+        if st.session_state['entry'] is None:
+            st.session_state['job'] = jobqueue().submit(fit_entry, name, data, fixel, settings, label=name)
+        else:
+            st.caption("Unchanged input and settings: showing the cached fit.")
+
+# Results of the last fit of this session stay on the page across reruns
+job_id = st.session_state.get('job')
+job = jobqueue().get(job_id) if job_id else None
+if job_id and job is None:
+    st.warning("This fit job has expired, please run the fit again.")
+elif job is not None and not job.done:
+    job_progress(job.id)
+elif job is not None and job.status == 'done':
+    show_entry(job.result)
+elif job is not None and job.status == 'cancelled':
+    st.warning(f"Fit of {job.label} cancelled after {job.nfev} model evaluations.")
+elif job is not None:
+    st.error(f"An error occurred: {job.error}")
+elif st.session_state.get('entry') is not None:
+    show_entry(st.session_state['entry'])
 # End Change2 Made by HM (02/06/2025)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from rv_orbital_fitting_with_advanced_gui import MASSNAMES, massdist
+
+EL = np.array([11.77, 1993.51, 0.22, 0.225, 106.3, 89.4, 82.6, 7.54, 6.96, -3.91])
+
+
+def test_massdist_without_parallax_leaves_mtot_undetermined():
+    cov = np.diag(np.full(10, 1e-4))
+    masses, summary = massdist(EL, 0.0, parallax_err=0.5, cov=cov, nsamples=2000, seed=1)
+    assert np.all(np.isnan(masses[:, 0]))
+    assert summary['Mtot']['n'] == 0
+    for name in MASSNAMES[1:]:
+        assert summary[name]['n'] == len(masses)
+
+
+def test_massdist_parallax_noise_drops_nonpositive_draws():
+    els = np.tile(EL, (5000, 1))
+    masses, summary = massdist(els, 1.0, parallax_err=1.0, seed=2)
+    assert 0 < summary['Mtot']['n'] < len(els)
+    assert np.all(masses[np.isfinite(masses[:, 0]), 0] > 0)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import rv_orbital_fitting_with_advanced_gui as rv
+from rv_orbital_fitting_with_advanced_gui import EPH_BACKENDS, eph_numpy, ephder, kepler
+
+EL = np.array([11.77, 1993.51, 0.62, 0.225, 106.3, 89.4, 82.6, 7.54, 6.96, -3.91])
+T = np.linspace(1990.0, 2010.0, 97)
+MODES = [dict(), dict(rho=True), dict(rv=True)]
+
+
+@pytest.mark.parametrize('mode', MODES, ids=['xy', 'rho', 'rv'])
+def test_numba_eph_matches_numpy(mode):
+    pytest.importorskip('numba')
+    eph_numba = EPH_BACKENDS['numba']()
+    els = EL + np.outer(np.linspace(-0.05, 0.05, 4), np.ones(10))
+    assert np.allclose(eph_numba(EL, T, **mode), eph_numpy(EL, T, **mode), rtol=0, atol=1e-8)
+    assert np.allclose(eph_numba(els, T, **mode), eph_numpy(els, T, **mode), rtol=0, atol=1e-8)
+
+
+@pytest.mark.parametrize('e', [0.0, 0.3, 0.6, 0.9])
+def test_kepler_danby_matches_newton(e):
+    M = np.linspace(-20.0, 20.0, 1001)
+    E_danby = kepler(M, e, tol=1e-12, maxiter=50, method='danby')
+    E_newton = kepler(M, e, tol=1e-12, maxiter=50, method='newton')
+    assert np.allclose(E_danby, E_newton, rtol=0, atol=1e-10)
+    assert np.allclose(E_danby - e * np.sin(E_danby), M, rtol=0, atol=1e-10)
+
+
+def test_kepler_rejects_unbound_and_unknown_method():
+    assert np.all(np.isnan(kepler(np.linspace(0, 6, 5), 1.2)))
+    with pytest.raises(ValueError):
+        kepler(np.zeros(3), 0.1, method='bisect')
+
+
+@pytest.mark.parametrize('mode', MODES, ids=['xy', 'rho', 'rv'])
+def test_ephder_matches_central_differences(mode, monkeypatch):
+    monkeypatch.setattr(rv, 'KEPLER_TOL', 1e-14)
+    monkeypatch.setattr(rv, 'KEPLER_MAXITER', 50)
+    res, der = ephder(EL, T, **mode)
+    assert np.allclose(res, eph_numpy(EL, T, **mode), rtol=0, atol=1e-10)
+    num = np.empty_like(der)
+    h = 1e-6
+    for k in range(10):
+        up, down = EL.copy(), EL.copy()
+        up[k] += h
+        down[k] -= h
+        diff = eph_numpy(up, T, **mode) - eph_numpy(down, T, **mode)
+        if mode.get('rho'):
+            diff[:, 0] = (diff[:, 0] + 180) % 360 - 180
+        num[:, :, k] = diff / (2 * h)
+    scale = np.abs(num).max(axis=0, keepdims=True)
+    assert np.all(np.abs(der - num) <= 1e-5 * scale + 1e-7)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from rv_orbital_fitting_with_advanced_gui import ELNAME, parsecsv, parseinp
+
+INP = """Object: Vanessa Va
+C 1990.0 1.0 0.1 0.01 I1
+P 10.5
+*K1 7.06
+1990.1 10.0 0.1 0.01 I1 M1
+1990.2 10.0 I1
+46632.364 -6.37 0.44 176 12.32 3.18 Va
+47012.343 -4.26 0.31 565 22.42 2.48 Va+b
+46632.364 -0.20 0.80 176 6.78 3.18 Vb
+2450000.5 1.0 0.5 COR Va
+"""
+
+CSV = """Object, Vanessa
+P,10.5
+# 1990.0,1.0,0.1,0.01,I1,X
+46632.364, -6.37 ,0.44, Va , COR
+1990.1,10.0,0.1,0.01,I1,SRC,,
+2450001,2,Va,X
+"""
+
+
+def test_parseinp_reads_rows_by_tag_column():
+    meta, el, fixel, obs = parseinp(INP, ELNAME)
+    assert meta == {'name': 'Vanessa Va'}
+    np.testing.assert_array_equal(obs['pos'], [[1990.1, 10.0, 0.1, 0.01, 0, 0]])
+    np.testing.assert_array_equal(obs['rv1'], [[46632.364, -6.37, 0.44], [47012.343, -4.26, 0.31]])
+    np.testing.assert_array_equal(obs['rv2'], [[46632.364, -0.20, 0.80]])
+
+
+def test_parseinp_ignores_starred_elements():
+    meta, el, fixel, obs = parseinp(INP, ELNAME)
+    assert el[0] == 10.5
+    assert el[ELNAME.index('K1')] == 0
+    assert np.all(fixel == 1)
+
+
+def test_parsecsv_reads_rows_and_sources():
+    meta, el, fixel, obs, sources = parsecsv(CSV, ELNAME)
+    assert meta == {'name': 'Vanessa'}
+    np.testing.assert_array_equal(obs['rv1'], [[46632.364, -6.37, 0.44]])
+    np.testing.assert_array_equal(obs['pos'], [[1990.1, 10.0, 0.1, 0.01, 0, 0]])
+    assert len(obs['rv2']) == 0
+    assert sources == {'pos': ['SRC'], 'rv1': ['COR'], 'rv2': []}